@@ -0,0 +1,589 @@
+"""NotifyPI 无界面基准测试
+
+在子进程中以 QT_QPA_PLATFORM=offscreen 运行 StatusBarApp（数据和设置隔离在临时目录），
+远端API由本进程内的模拟服务代替，对接收服务和远端轮询施加负载，
+再从 GET /stats 读取展示延迟、事件循环延迟等指标，结果以 JSON 输出。
+
+    python bench/bench.py
+    python bench/bench.py --scenarios single,concurrent --engine asyncio --output bench_output.json
+
+场景：
+    single      顺序发送单条通知
+    batch       以 JSON 数组批量发送
+    concurrent  多个线程同时发送单条通知
+    poll        多个远端数据源定时轮询模拟服务
+    sse         模拟服务以 SSE 推送通知，定期断开连接并注入失败
+    longpoll    模拟服务以长轮询推送通知，同样注入失败
+
+sse 和 longpoll 场景同时检查推送客户端：通知全部送达且不重复（dispatch）、重连时从上次收到的位置
+继续（resume，即 Last-Event-ID 或游标参数）、连续失败时按指数退避重连（backoff）。
+结果的 checks 中有未通过的项时以退出码1结束。
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("single", "batch", "concurrent", "poll", "sse", "longpoll")
+STREAM_SCENARIOS = ("sse", "longpoll")
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_app(home):
+    """子进程入口：运行应用直到收到 SIGTERM，退出时输出峰值内存"""
+    os.environ["NOTIFYPI_HOME"] = home
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    sys.path.insert(0, REPO_DIR)
+    import pi_app
+
+    app = pi_app.StatusBarApp()
+    app.app.exec()
+
+    peak_rss_kb = None
+    try:
+        import resource
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_rss_kb //= 1024  # macOS 下单位是字节
+    except ImportError:
+        pass
+    # 应用会把 sys.stdout 重定向到日志
+    sys.__stdout__.write(json.dumps({"peak_rss_kb": peak_rss_kb}) + "\n")
+    sys.__stdout__.flush()
+
+
+class StandInAPI:
+    """模拟远端API：每次请求返回 per_poll 条新通知，停止后返回空列表"""
+
+    def __init__(self, per_poll):
+        self.per_poll = per_poll
+        self.served = 0
+        self.requests = 0
+        self.first_request = None
+        self.active = True
+        self._lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with api._lock:
+                    api.requests += 1
+                    if api.first_request is None:
+                        api.first_request = time.monotonic()
+                    count = api.per_poll if api.active else 0
+                    start, api.served = api.served, api.served + count
+                notifications = [{
+                    "id": f"bench-{i}",
+                    "title": "基准测试",
+                    "message": f"远端通知 {i}"
+                } for i in range(start, start + count)]
+                body = json.dumps({"notifications": notifications}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StandInStream:
+    """模拟推送数据源（mode 为 sse 或 longpoll），同时记录客户端的每次连接用于检查
+
+    第一次连接到达后，生产线程在 duration 秒内以每秒 rate 条的速度产生通知。SSE 连接每发送
+    per_connection 条后由服务端断开，长轮询每次最多返回 per_connection 条；第一次连接之后的
+    fail_streak 次连接返回503，用来检查重连退避。
+    """
+    RETRY_MS = 200  # SSE 通过 retry 字段下发的重连间隔，缩短测试时间
+    HOLD = 0.5  # 秒，长轮询没有新通知时挂起的时长
+    HEARTBEAT = 1  # 秒，SSE 空闲时的心跳间隔
+
+    def __init__(self, mode, rate, duration, per_connection, fail_streak):
+        self.mode = mode
+        self.rate = rate
+        self.duration = duration
+        self.per_connection = per_connection
+        self.fail_streak = fail_streak
+        self.events = []  # 序号为下标加1
+        self.attempts = []  # 每次连接：到达时间、状态码、客户端给出的续传位置、此时服务端最后发出的序号
+        self.last_sent = 0
+        self.produced = False
+        self.closed = False
+        self._cond = threading.Condition()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if api.mode == "sse":
+                    resume = self.headers.get("Last-Event-ID")
+                else:
+                    query = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)
+                    resume = query.get("since", [None])[0]
+                status = api._record_attempt(resume)
+                if status != 200:
+                    self.send_error(status)
+                elif api.mode == "sse":
+                    api._serve_sse(self, int(resume or 0))
+                else:
+                    api._serve_longpoll(self, int(resume or 0))
+
+            def log_message(self, format, *args):
+                return
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def first_request(self):
+        return self.attempts[0]["at"] if self.attempts else None
+
+    def _record_attempt(self, resume):
+        with self._cond:
+            index = len(self.attempts)
+            status = 503 if 1 <= index <= self.fail_streak else 200
+            self.attempts.append({
+                "at": time.monotonic(),
+                "status": status,
+                "resume": resume,
+                "expected": str(self.last_sent) if self.last_sent else None
+            })
+        if index == 0:
+            threading.Thread(target=self._produce, daemon=True).start()
+        return status
+
+    def _produce(self):
+        started = time.monotonic()
+        for i in range(int(self.rate * self.duration)):
+            time.sleep(max(0.0, started + i / self.rate - time.monotonic()))
+            with self._cond:
+                self.events.append({
+                    "id": f"bench-{self.mode}-{i}", "title": "基准测试", "message": f"推送通知 {i}"
+                })
+                self._cond.notify_all()
+        with self._cond:
+            self.produced = True
+            self._cond.notify_all()
+
+    def _take(self, position, limit, timeout):
+        """返回 position 之后最多 limit 条 (序号, 通知)，没有时最多等待 timeout 秒"""
+        with self._cond:
+            if position >= len(self.events) and not self.closed:
+                self._cond.wait(timeout)
+            end = min(len(self.events), position + limit)
+            return [(seq, self.events[seq - 1]) for seq in range(position + 1, end + 1)]
+
+    def _mark_sent(self, seq):
+        with self._cond:
+            self.last_sent = max(self.last_sent, seq)
+            self._cond.notify_all()
+
+    def _serve_sse(self, handler, position):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        try:
+            handler.wfile.write(f"retry: {self.RETRY_MS}\n\n".encode("utf-8"))
+            remaining = self.per_connection
+            while remaining and not self.closed:
+                batch = self._take(position, remaining, self.HEARTBEAT)
+                if batch:
+                    handler.wfile.write("".join(
+                        f"id: {seq}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n" for seq, event in batch
+                    ).encode("utf-8"))
+                    position = batch[-1][0]
+                    remaining -= len(batch)
+                    self._mark_sent(position)
+                else:
+                    handler.wfile.write(b": ping\n\n")
+                handler.wfile.flush()
+        except OSError:
+            pass  # 客户端已断开
+
+    def _serve_longpoll(self, handler, position):
+        batch = self._take(position, self.per_connection, self.HOLD)
+        if batch:
+            self._mark_sent(batch[-1][0])
+        body = json.dumps({
+            "notifications": [event for _, event in batch],
+            "next_cursor": str(batch[-1][0]) if batch else None
+        }, ensure_ascii=False).encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def wait_delivered(self, timeout=60):
+        """等待生产结束且全部通知都已发出，返回通知总数"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while not (self.produced and self.last_sent >= len(self.events)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return len(self.events)
+
+    def check_resume(self):
+        """每次重连给出的续传位置都应是服务端最后发出的序号，返回不一致的连接"""
+        return [
+            {"attempt": index, "resume": attempt["resume"], "expected": attempt["expected"]}
+            for index, attempt in enumerate(self.attempts) if attempt["resume"] != attempt["expected"]
+        ]
+
+    def backoff_gaps(self, base):
+        """返回每次失败后到下一次连接的 (间隔秒数, 允许的最小值, 允许的最大值)
+
+        StreamClient 第 k 次连续失败后等待 [base * 2^(k-1) / 2, base * 2^(k-1)] 之间的随机时长。
+        """
+        gaps = []
+        failures = 0
+        for previous, attempt in zip(self.attempts, self.attempts[1:]):
+            if previous["status"] == 200:
+                failures = 0
+                continue
+            failures += 1
+            delay = base * 2 ** (failures - 1)
+            gaps.append((attempt["at"] - previous["at"], delay / 2, delay))
+        return gaps
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AppProcess:
+    """以隔离的数据目录启动应用子进程"""
+
+    def __init__(self, args, settings):
+        self.port = args.port
+        self.home = tempfile.mkdtemp(prefix="notifypi-bench-")
+        self._write_settings(dict({
+            "server_port": args.port,
+            "receiver_engine": args.engine,
+            "coalesce_window": args.coalesce_window,
+            "sound_enabled": False,
+            "native_backend": "none",
+            "api_enabled": False,
+            "rate_limit": args.rate_limit,
+        }, **settings))
+        env = dict(os.environ, QT_QPA_PLATFORM="offscreen")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--run-app", self.home],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        self._wait_ready()
+
+    def _write_settings(self, values):
+        from PySide6.QtCore import QSettings
+        settings = QSettings(os.path.join(self.home, "settings.ini"), QSettings.IniFormat)
+        for key, value in values.items():
+            settings.setValue(key, value)
+        settings.sync()
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("应用进程启动失败")
+            try:
+                return self.stats()
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("等待应用启动超时")
+
+    def stats(self):
+        with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/stats", timeout=5) as response:
+            return json.loads(response.read())
+
+    def wait_displayed(self, expected, timeout=60):
+        """等待 expected 条通知全部展示，返回最后一次读取的指标"""
+        deadline = time.monotonic() + timeout
+        while True:
+            stats = self.stats()
+            displayed = stats.get("display_latency_seconds", {}).get("count", 0)
+            if displayed >= expected or time.monotonic() > deadline:
+                return stats
+            time.sleep(0.05)
+
+    def stop(self):
+        """结束应用并返回峰值内存（KB）"""
+        self.process.send_signal(signal.SIGTERM)
+        try:
+            output, _ = self.process.communicate(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            output, _ = self.process.communicate()
+        shutil.rmtree(self.home, ignore_errors=True)
+        for line in output.splitlines():
+            if line.startswith("{"):
+                return json.loads(line).get("peak_rss_kb")
+        return None
+
+
+def post(port, payload, content_type="application/json"):
+    """发送一次POST，返回请求耗时（秒），失败时返回 None"""
+    body = json.dumps(payload).encode("utf-8")
+    started = time.monotonic()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        connection.request("POST", "/", body, {"Content-Type": content_type})
+        response = connection.getresponse()
+        response.read()
+        if response.status != 200:
+            return None
+    except OSError:
+        return None
+    finally:
+        connection.close()
+    return time.monotonic() - started
+
+
+def notification(index):
+    return {"id": f"bench-{index}", "title": "基准测试", "message": f"通知 {index}"}
+
+
+# 负载函数返回 [(请求耗时或 None, 该请求包含的通知数)]
+
+def load_single(app, args):
+    return [(post(app.port, notification(i)), 1) for i in range(args.count)]
+
+
+def load_batch(app, args):
+    requests = []
+    for start in range(0, args.count, args.batch_size):
+        batch = [notification(i) for i in range(start, min(start + args.batch_size, args.count))]
+        requests.append((post(app.port, batch), len(batch)))
+    return requests
+
+
+def load_concurrent(app, args):
+    requests = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = [(post(app.port, notification(i)), 1) for i in range(offset, args.count, args.concurrency)]
+        with lock:
+            requests.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return requests
+
+
+def run_scenario(name, args):
+    api = None
+    settings = {}
+    if name == "poll":
+        api = StandInAPI(args.per_poll)
+        settings = {
+            "api_enabled": True,
+            "api_sources": json.dumps([{
+                "name": f"bench{i}",
+                "url": f"http://127.0.0.1:{api.port}/source{i}",
+                "interval": args.poll_interval,
+                "timeout": 10
+            } for i in range(args.poll_sources)])
+        }
+    elif name in STREAM_SCENARIOS:
+        api = StandInStream(name, args.stream_rate, args.poll_duration, args.per_connection, args.fail_streak)
+        settings = {
+            "api_enabled": True,
+            "api_sources": json.dumps([{
+                "name": f"bench-{name}",
+                "url": f"http://127.0.0.1:{api.port}/{name}",
+                "mode": name,
+                "cursor_param": "since",
+                "timeout": 10
+            }])
+        }
+
+    app = AppProcess(args, settings)
+    try:
+        started = time.monotonic()
+        if name == "poll":
+            # 应用启动后延迟几秒才开始第一次轮询，从第一次请求开始计时
+            while api.first_request is None and time.monotonic() - started < 30:
+                time.sleep(0.05)
+            started = api.first_request or started
+            time.sleep(max(0.0, started + args.poll_duration - time.monotonic()))
+            api.active = False
+            requests, expected = [], api.served
+        elif name in STREAM_SCENARIOS:
+            while api.first_request is None and time.monotonic() - started < 30:
+                time.sleep(0.05)
+            started = api.first_request or started
+            requests, expected = [], api.wait_delivered(args.poll_duration + 60)
+        else:
+            requests = globals()[f"load_{name}"](app, args)
+            expected = sum(count for latency, count in requests if latency is not None)
+        sent = time.monotonic()
+        stats = app.wait_displayed(expected)
+        finished = time.monotonic()
+    finally:
+        peak_rss_kb = app.stop()
+        if api:
+            api.close()
+
+    display = stats.get("display_latency_seconds", {})
+    lag = stats.get("event_loop_lag_seconds", {})
+    result = {
+        "scenario": name,
+        "engine": args.engine,
+        "notifications": expected,
+        "displayed": display.get("count", 0),
+        "send_seconds": round(sent - started, 3),
+        "total_seconds": round(finished - started, 3),
+        "throughput_per_second": round(display.get("count", 0) / (finished - started), 1)
+        if finished > started else None,
+        # 展示延迟由应用内的直方图估算，精度为桶边界
+        "display_latency_ms": {
+            key: round(display[key] * 1000, 3) for key in ("p50", "p99", "max") if key in display
+        },
+        "gui_stall_ms": {
+            "total": round(lag.get("avg", 0) * lag.get("count", 0) * 1000, 3),
+            "max": round(lag.get("max", 0) * 1000, 3),
+            "p99": round(lag.get("p99", 0) * 1000, 3)
+        },
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1) if peak_rss_kb else None
+    }
+    latencies = [latency for latency, count in requests if latency is not None]
+    if requests:
+        result["requests"] = len(requests)
+        result["failed_requests"] = len(requests) - len(latencies)
+    if latencies:
+        result["request_latency_ms"] = {
+            "p50": round(percentile(latencies, 0.5) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3)
+        }
+    if name == "poll":
+        result["api_requests"] = api.requests
+        result["polls"] = stats.get("polls", {})
+    if name in STREAM_SCENARIOS:
+        result.update(stream_checks(api, name, stats, expected))
+    return result
+
+
+def stream_checks(api, name, stats, expected):
+    """推送场景的检查：送达、续传和重连退避"""
+    sys.path.insert(0, REPO_DIR)
+    from pi_core import StreamClient
+
+    base = api.RETRY_MS / 1000 if name == "sse" else StreamClient.DEFAULT_RETRY
+    gaps = api.backoff_gaps(base)
+    mismatches = api.check_resume()
+    received = stats.get("received", {}).get(name, 0)
+    displayed = stats.get("display_latency_seconds", {}).get("count", 0)
+    return {
+        "stream": {
+            "connections": len(api.attempts),
+            "injected_failures": sum(1 for attempt in api.attempts if attempt["status"] != 200),
+            "received": received,
+            "backoff_ms": [
+                {"actual": round(gap * 1000), "min": round(low * 1000), "max": round(high * 1000)}
+                for gap, low, high in gaps
+            ],
+            "resume_mismatches": mismatches
+        },
+        "checks": {
+            "dispatch": expected > 0 and received == expected and displayed == expected,
+            "resume": len(api.attempts) > 1 and not mismatches,
+            # 失败后的等待从收到503开始计时，上限额外留出请求本身的耗时
+            "backoff": len(gaps) == api.fail_streak
+            and all(low <= gap <= high + 0.5 for gap, low, high in gaps)
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NotifyPI 无界面基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景，可选: {', '.join(SCENARIOS)}")
+    parser.add_argument("--engine", choices=("threading", "asyncio"), default="threading")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--count", type=int, default=2000, help="每个场景发送的通知数")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate-limit", type=int, default=0, help="每客户端限速（条/秒），默认不限速")
+    parser.add_argument("--coalesce-window", type=int, default=0, help="合并窗口（毫秒），默认不合并")
+    parser.add_argument("--poll-sources", type=int, default=4)
+    parser.add_argument("--poll-interval", type=int, default=2, help="数据源轮询间隔（秒）")
+    parser.add_argument("--per-poll", type=int, default=50, help="模拟服务每次返回的通知数")
+    parser.add_argument("--poll-duration", type=float, default=10, help="轮询和推送场景持续的秒数")
+    parser.add_argument("--stream-rate", type=float, default=100, help="推送场景每秒产生的通知数")
+    parser.add_argument("--per-connection", type=int, default=100,
+                        help="SSE 每个连接发送的通知数（之后由服务端断开），长轮询每次返回的上限")
+    parser.add_argument("--fail-streak", type=int, default=2, help="推送场景第一次连接后连续返回503的次数")
+    parser.add_argument("--output", help="结果写入文件，默认输出到标准输出")
+    parser.add_argument("--run-app", metavar="HOME", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_app:
+        run_app(args.run_app)
+        return
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+
+    results = []
+    for name in names:
+        print(f"运行场景 {name} ...", file=sys.stderr)
+        results.append(run_scenario(name, args))
+
+    report = json.dumps({
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "results": results
+    }, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+    failed = [f"{result['scenario']}.{check}" for result in results
+              for check, passed in result.get("checks", {}).items() if not passed]
+    if failed:
+        print(f"检查未通过: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
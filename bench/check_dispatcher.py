@@ -0,0 +1,114 @@
+"""NotificationDispatcher 检查
+
+不启动界面，直接用 RecordingBackend 驱动 pi_app.NotificationDispatcher，检查：
+    send        通知经后台线程按顺序交给后端
+    rate_limit  超过后端限速（突发量）的通知被丢弃并计入 rate_limited
+    overflow    后端阻塞、队列满时的通知被丢弃并计入 dropped
+    summary     丢弃的条数在后端可以发送时汇总为一条通知补发，且只报告一次
+结果以 JSON 输出，有未通过的项时以退出码1结束。
+
+    python bench/check_dispatcher.py
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from pi_app import NotificationDispatcher, RecordingBackend  # noqa: E402
+
+
+class BlockingBackend(RecordingBackend):
+    """第一条通知阻塞到 release 被设置，用于把分发队列塞满"""
+    name = "blocking"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def send(self, title, message):
+        self.started.set()
+        self.release.wait()
+        super().send(title, message)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def summaries(backend):
+    return [message for title, message in backend.sent if title == NotificationDispatcher.SUMMARY_TITLE]
+
+
+def check_rate_limit():
+    """突发量为3、每秒补充5个令牌：连续10条中前3条发送，其余7条汇总"""
+    backend = RecordingBackend(rate=5, burst=3)
+    dispatcher = NotificationDispatcher(backend)
+    items = [(f"t{i}", f"m{i}") for i in range(10)]
+    for item in items:
+        dispatcher.dispatch(*item)
+    wait_for(lambda: summaries(backend))
+    # 汇总之后不应再重复报告
+    time.sleep(0.5)
+    dispatcher.stop()
+    sent = [item for item in backend.sent if item[0] != NotificationDispatcher.SUMMARY_TITLE]
+    return {
+        "sent": len(sent),
+        "rate_limited": dispatcher.rate_limited,
+        "summaries": summaries(backend)
+    }, {
+        "send": sent == items[:3],
+        "rate_limit": dispatcher.rate_limited == 7 and dispatcher.dropped == 0,
+        "summary": summaries(backend) == ["另有 7 条通知未显示"] and backend.sent[-1][0] == NotificationDispatcher.SUMMARY_TITLE
+    }
+
+
+def check_overflow():
+    """后端阻塞时队列只容纳2条，其余通知溢出丢弃，后端恢复后汇总"""
+    backend = BlockingBackend(rate=100, burst=100)
+    dispatcher = NotificationDispatcher(backend, queue_size=2)
+    dispatcher.dispatch("t0", "m0")
+    backend.started.wait(5)
+    for i in range(1, 9):
+        dispatcher.dispatch(f"t{i}", f"m{i}")
+    backend.release.set()
+    wait_for(lambda: summaries(backend))
+    time.sleep(0.2)
+    dispatcher.stop()
+    sent = [item for item in backend.sent if item[0] != NotificationDispatcher.SUMMARY_TITLE]
+    return {
+        "sent": len(sent),
+        "dropped": dispatcher.dropped,
+        "summaries": summaries(backend)
+    }, {
+        "send": sent == [("t0", "m0"), ("t1", "m1"), ("t2", "m2")],
+        "overflow": dispatcher.dropped == 6 and dispatcher.rate_limited == 0,
+        "summary": summaries(backend) == ["另有 6 条通知未显示"]
+    }
+
+
+def main():
+    results = []
+    for name, check in (("rate_limit", check_rate_limit), ("overflow", check_overflow)):
+        details, checks = check()
+        results.append({"case": name, **details, "checks": checks})
+    print(json.dumps({"results": results}, ensure_ascii=False, indent=2))
+
+    failed = [f"{result['case']}.{check}" for result in results
+              for check, passed in result["checks"].items() if not passed]
+    if failed:
+        print(f"检查未通过: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
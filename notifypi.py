@@ -0,0 +1,366 @@
+"""NotifyPI 命令行客户端
+
+通过 APP_DIR/ingest.sock 向本机运行的 NotifyPI（托盘应用或守护进程）发送通知：
+
+    python notifypi.py send "编译完成" "release 构建已完成"
+    some-producer | python notifypi.py send --stdin
+    python notifypi.py wrap -- make test
+    python notifypi.py flush
+
+应用未运行或持续限速时通知会追加到 APP_DIR/spool.ndjson，下次发送成功后（或执行 flush）补发暂存的通知。
+只依赖标准库，导入开销很小，适合包装大量短任务。
+"""
+import argparse
+import collections
+import fcntl
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+# 与 pi_core.APP_DIR 相同，这里不导入 pi_core 以减少启动耗时
+APP_DIR = os.environ.get("NOTIFYPI_HOME") or os.path.expanduser("~/.pi_notification")
+SOCKET_PATH = os.path.join(APP_DIR, "ingest.sock")
+SPOOL_PATH = os.path.join(APP_DIR, "spool.ndjson")
+TIMEOUT = 10  # 秒，等待应用响应的超时
+RETRIES = 3  # 被限速或接收队列已满时的重试次数
+MAX_RETRY_WAIT = 5  # 秒，单次重试最多等待的时间
+CHUNK_BYTES = 64 * 1024  # 补发时每块的最大字节数，收到这一块的响应后再发下一块
+
+class Connection:
+    """到 ingest.sock 的连接，每发送一行JSON返回一行响应"""
+
+    def __init__(self, path=SOCKET_PATH, timeout=TIMEOUT):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.reader = self.sock.makefile("rb")
+
+    def send(self, lines):
+        """发送多行（bytes，不含换行），返回对应的响应字典列表"""
+        self.sock.sendall(b"".join(line + b"\n" for line in lines))
+        return [self._read_response() for _ in lines]
+
+    def stream(self, lines, on_response):
+        """边发送边由读线程接收响应，发送完毕后等待全部响应，返回尚未确认的行
+
+        读写分开在两个线程，发送大量通知时不会因为双方缓冲区写满而互相等待。
+        """
+        unacked = collections.deque()
+        lock = threading.Lock()
+
+        def read_loop():
+            try:
+                while True:
+                    response = self._read_response()
+                    with lock:
+                        line = unacked.popleft()
+                    on_response(line, response)
+            except (OSError, ValueError, IndexError):
+                pass
+
+        reader = threading.Thread(target=read_loop, daemon=True)
+        reader.start()
+        lines = iter(lines)
+        try:
+            for line in lines:
+                with lock:
+                    unacked.append(line)
+                self.sock.sendall(line + b"\n")
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        reader.join()
+        # 连接中断时，未确认的行和尚未发送的行一起返回给调用方暂存
+        return list(unacked) + list(lines)
+
+    def _read_response(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("应用关闭了连接")
+        return json.loads(line)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+def connect():
+    """连接应用，应用未运行时返回 None"""
+    try:
+        return Connection()
+    except OSError:
+        return None
+
+def flush_after_send(connection):
+    """本次的通知发送成功后再补发暂存的通知，暂存的通知不会占用本次通知的限速配额；失败时留到下次"""
+    try:
+        flush_spool(connection)
+    except (OSError, ValueError):
+        pass
+
+def prepare_for_spool(notification):
+    """暂存的通知补上时间戳和id：显示的是实际发生的时间，重复补发时也能被应用去重"""
+    notification = dict(notification)
+    notification.setdefault("timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    notification.setdefault("id", uuid.uuid4().hex)
+    return notification
+
+def _open_spool(flags):
+    """打开并锁定暂存文件；文件在等待锁期间被 flush 删除时重新打开"""
+    while True:
+        fd = os.open(SPOOL_PATH, flags, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        if os.fstat(fd).st_nlink:
+            return fd
+        os.close(fd)
+
+def spool(lines):
+    """把通知（已序列化的行）追加到暂存文件"""
+    if not lines:
+        return
+    os.makedirs(APP_DIR, exist_ok=True)
+    fd = _open_spool(os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+    try:
+        os.write(fd, b"".join(line + b"\n" for line in lines))
+    finally:
+        os.close(fd)
+
+def chunked(lines, limit=CHUNK_BYTES):
+    """按字节数分块，一块的请求和响应都能放进套接字缓冲区，不会因双方都在写而互相等待"""
+    chunk, size = [], 0
+    for line in lines:
+        if chunk and size + len(line) > limit:
+            yield chunk
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        yield chunk
+
+def flush_spool(connection):
+    """通过 connection 补发暂存的通知，返回补发的条数
+
+    发送中断时保留暂存文件；被限速或接收队列已满而拒绝的通知写回暂存文件，下次再补发。
+    """
+    try:
+        fd = _open_spool(os.O_RDWR)
+    except FileNotFoundError:
+        return 0
+    try:
+        with os.fdopen(os.dup(fd), "rb") as f:
+            lines = [line.rstrip(b"\n") for line in f if line.strip()]
+        responses = []
+        for chunk in chunked(lines):
+            responses.extend(connection.send(chunk))
+        rejected = [line for line, response in zip(lines, responses) if "retry_after" in response]
+        if rejected:
+            os.ftruncate(fd, 0)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.write(fd, b"".join(line + b"\n" for line in rejected))
+        else:
+            os.unlink(SPOOL_PATH)
+        return len(lines) - len(rejected)
+    finally:
+        os.close(fd)
+
+def encode(notification):
+    return json.dumps(notification, ensure_ascii=False).encode("utf-8")
+
+def retry_wait(responses):
+    return min(MAX_RETRY_WAIT, max(response["retry_after"] for response in responses))
+
+def deliver(notification):
+    """发送单条通知并返回应用的响应，发送成功后补发暂存的通知
+
+    被限速或接收队列已满时按 retry_after 等待后重试。应用未运行或连接中断时暂存，返回 None；
+    重试次数用完时暂存，返回最后一次带 retry_after 的响应。
+    """
+    response = None
+    for attempt in range(RETRIES + 1):
+        connection = connect()
+        if connection is None:
+            response = None
+            break
+        try:
+            response = connection.send([encode(notification)])[0]
+            if "retry_after" not in response:
+                flush_after_send(connection)
+                return response
+        except (OSError, ValueError):
+            response = None
+            break
+        finally:
+            connection.close()
+        if attempt < RETRIES:
+            time.sleep(retry_wait([response]))
+    spool([encode(prepare_for_spool(notification))])
+    return response
+
+def cmd_send(args):
+    if args.stdin:
+        return send_stdin()
+    notification = {"title": args.title, "message": args.message}
+    if args.id:
+        notification["id"] = args.id
+    response = deliver(notification)
+    if response is None:
+        print(f"应用未运行，通知已暂存到 {SPOOL_PATH}", file=sys.stderr)
+    elif "retry_after" in response:
+        print(f"{response.get('message')}，重试 {RETRIES} 次后通知已暂存到 {SPOOL_PATH}", file=sys.stderr)
+    elif response.get("status") != "success":
+        print(f"发送失败: {response.get('message')}", file=sys.stderr)
+        return 1
+    return 0
+
+def send_stdin():
+    """每行一个JSON对象，整个输入复用一条连接；无效的行报告后跳过"""
+    failed = 0
+
+    def parsed_lines():
+        nonlocal failed
+        for number, line in enumerate(sys.stdin.buffer, 1):
+            if not line.strip():
+                continue
+            try:
+                notification = json.loads(line)
+                if not isinstance(notification, dict):
+                    raise ValueError("不是JSON对象")
+            except ValueError as e:
+                failed += 1
+                print(f"第 {number} 行无效，已跳过: {e}", file=sys.stderr)
+                continue
+            yield notification
+
+    rejected = []
+
+    def on_response(line, response):
+        nonlocal failed
+        if "retry_after" in response:
+            rejected.append((line, response))
+        elif response.get("status") != "success":
+            failed += 1
+            print(f"发送失败: {response.get('message')}", file=sys.stderr)
+
+    lines = (encode(n) for n in parsed_lines())
+    unsent = []
+    for attempt in range(RETRIES + 1):
+        connection = connect()
+        if connection is None:
+            unsent.extend(lines)
+            break
+        try:
+            unsent.extend(connection.stream(lines, on_response))
+        finally:
+            connection.close()
+        if not rejected or unsent:
+            break
+        # 被限速或接收队列已满的通知等待后重新发送
+        lines = [line for line, response in rejected]
+        if attempt < RETRIES:
+            time.sleep(retry_wait([response for line, response in rejected]))
+            rejected.clear()
+
+    if unsent:
+        print(f"应用未运行或连接中断，{len(unsent)} 条通知已暂存到 {SPOOL_PATH}", file=sys.stderr)
+    if rejected:
+        print(f"被限速或接收队列已满，重试 {RETRIES} 次后 {len(rejected)} 条通知已暂存到 {SPOOL_PATH}",
+              file=sys.stderr)
+    pending = unsent + [line for line, response in rejected]
+    if pending:
+        spool([encode(prepare_for_spool(json.loads(line))) for line in pending])
+    else:
+        connection = connect()
+        if connection is not None:
+            try:
+                flush_after_send(connection)
+            finally:
+                connection.close()
+    return 1 if failed else 0
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.1f}秒"
+    minutes, seconds = divmod(int(seconds), 60)
+    if minutes < 60:
+        return f"{minutes}分{seconds}秒"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}小时{minutes}分"
+
+def cmd_wrap(args):
+    """运行命令，结束后发送包含退出码和耗时的通知，并以命令的退出码退出"""
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        print("wrap 需要要运行的命令，例如: notifypi wrap -- make test", file=sys.stderr)
+        return 2
+
+    started = time.monotonic()
+    try:
+        process = subprocess.Popen(command)
+    except OSError as e:
+        print(f"无法运行命令: {e}", file=sys.stderr)
+        returncode = 127
+    else:
+        while True:
+            try:
+                returncode = process.wait()
+                break
+            except KeyboardInterrupt:
+                # Ctrl-C 同时发给了子进程，等它退出后照常发送通知
+                continue
+    elapsed = time.monotonic() - started
+
+    name = args.title or os.path.basename(command[0])
+    status = "已完成" if returncode == 0 else f"失败（退出码 {returncode}）"
+    deliver({
+        "title": f"{name} {status}",
+        "message": f"{shlex.join(command)}\n耗时 {format_duration(elapsed)}"
+    })
+    return returncode if returncode >= 0 else 128 - returncode
+
+def cmd_flush(args):
+    try:
+        connection = Connection()
+    except OSError:
+        print("应用未运行，暂存的通知保留到下次发送", file=sys.stderr)
+        return 1
+    try:
+        count = flush_spool(connection)
+    finally:
+        connection.close()
+    print(f"已补发 {count} 条暂存的通知")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(prog="notifypi", description="向本机运行的 NotifyPI 发送通知")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+    send_parser = subparsers.add_parser("send", help="发送一条通知")
+    send_parser.add_argument("title", nargs="?", default="通知")
+    send_parser.add_argument("message", nargs="?", default="")
+    send_parser.add_argument("--id", help="通知id，应用按 id 去重")
+    send_parser.add_argument("--stdin", action="store_true", help="从标准输入读取NDJSON，每行一条通知")
+    send_parser.set_defaults(func=cmd_send)
+
+    wrap_parser = subparsers.add_parser("wrap", help="运行命令，结束后发送通知")
+    wrap_parser.add_argument("--title", help="通知标题，默认使用命令名")
+    wrap_parser.add_argument("command", nargs=argparse.REMAINDER, help="-- 之后是要运行的命令")
+    wrap_parser.set_defaults(func=cmd_wrap)
+
+    flush_parser = subparsers.add_parser("flush", help="补发应用未运行时暂存的通知")
+    flush_parser.set_defaults(func=cmd_flush)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
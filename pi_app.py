@@ -1,3 +1,5 @@
+import time
+_PROCESS_STARTED = time.perf_counter()  # 用于 --profile-startup 统计模块导入耗时
 import sys
 import json
 import platform
@@ -5,16 +7,18 @@ import subprocess
 import threading
 import signal
 import os
-import requests
 import logging
-import time
-from logging.handlers import RotatingFileHandler
-from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import bisect
+import queue
+import shutil
+import re
+from array import array
 from PySide6.QtWidgets import (
     QApplication, QSystemTrayIcon, QMenu, QMessageBox, QLabel,
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QToolTip,
-    QDialog, QCheckBox, QFormLayout, QLineEdit, QSpinBox, QGroupBox,
-    QTextBrowser, QTextEdit
+    QDialog, QCheckBox, QFormLayout, QSpinBox, QGroupBox,
+    QPlainTextEdit, QComboBox, QListView, QAbstractItemView,
+    QTableWidget, QTableWidgetItem, QHeaderView, QDateTimeEdit
 )
 from PySide6.QtGui import (
     QAction, QIcon, QPixmap, QFont, QColor, QPalette,
@@ -22,60 +26,236 @@ from PySide6.QtGui import (
 )
 from PySide6.QtCore import (
     Qt, QTimer, QPoint, QSize, Signal, QObject,
-    QEvent, QSettings, QUrl
+    QEvent, QSettings, QUrl, QAbstractListModel, QModelIndex,
+    QPropertyAnimation, QFileSystemWatcher, QDateTime
 )
-from PySide6.QtMultimedia import QSoundEffect
-from datetime import datetime
 from functools import partial
+from collections import OrderedDict
 
 from _version import __version__
+from pi_core import (
+    APP_DIR, HistoryStore, Metrics, NotificationDaemon, QueuedLogging, TokenBucket, load_poll_sources
+)
+
+def app_settings():
+    """应用设置，默认使用系统的设置存储，隔离运行时使用 APP_DIR/settings.ini"""
+    if os.environ.get("NOTIFYPI_HOME"):
+        return QSettings(os.path.join(APP_DIR, "settings.ini"), QSettings.IniFormat)
+    return QSettings("PiApp", "NotificationApp")
+
+class NotificationBackend:
+    """系统通知后端基类，send 在分发器的工作线程中调用"""
+    name = "base"
+    rate = 1.0  # 每秒允许的通知数
+    burst = 3
+
+    def available(self):
+        return True
+
+    def send(self, title, message):
+        raise NotImplementedError
+
+class OsascriptBackend(NotificationBackend):
+    """macOS 通知中心，标题和内容作为 argv 传入脚本，不做字符串拼接"""
+    name = "osascript"
+    SCRIPT = [
+        "-e", "on run argv",
+        "-e", "display notification (item 2 of argv) with title (item 1 of argv)",
+        "-e", "end run"
+    ]
+
+    def available(self):
+        return platform.system() == "Darwin" and shutil.which("osascript") is not None
+
+    def send(self, title, message):
+        subprocess.run(
+            ["osascript", *self.SCRIPT, title, message],
+            capture_output=True, timeout=5, check=False
+        )
+
+class NotifySendBackend(NotificationBackend):
+    """Linux 桌面通知（通过 notify-send 走 D-Bus）"""
+    name = "notify-send"
 
-class NotificationHandler(BaseHTTPRequestHandler):
-    def _set_response(self, content_type="text/plain"):
-        self.send_response(200)
-        self.send_header("Content-type", content_type)
-        self.end_headers()
+    def available(self):
+        return shutil.which("notify-send") is not None
+
+    def send(self, title, message):
+        subprocess.run(
+            ["notify-send", "--app-name=NotifyPI", "--", title, message],
+            capture_output=True, timeout=5, check=False
+        )
 
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        post_data = self.rfile.read(content_length)
+class _TrayMessageBridge(QObject):
+    message_requested = Signal(str, str)
+
+    def __init__(self, tray_icon):
+        super().__init__()
+        self.tray_icon = tray_icon
+        self.message_requested.connect(self.show_message)
+
+    def show_message(self, title, message):
+        self.tray_icon.showMessage(title, message, QSystemTrayIcon.Information, 5000)
+
+class TrayMessageBackend(NotificationBackend):
+    """托盘气泡通知，通过信号转回GUI线程显示"""
+    name = "tray"
+
+    def __init__(self, tray_icon):
+        self.bridge = _TrayMessageBridge(tray_icon)
+
+    def send(self, title, message):
+        self.bridge.message_requested.emit(title, message)
+
+class NullBackend(NotificationBackend):
+    """不发送系统通知"""
+    name = "none"
+    rate = float("inf")
+    burst = float("inf")
+
+    def send(self, title, message):
+        pass
+
+class RecordingBackend(NullBackend):
+    """记录所有通知，便于测试和调试；可以指定限速，用于检查分发器的限速和汇总"""
+    name = "recording"
+
+    def __init__(self, rate=None, burst=None):
+        self.sent = []
+        if rate is not None:
+            self.rate = rate
+        if burst is not None:
+            self.burst = burst
+
+    def send(self, title, message):
+        self.sent.append((title, message))
+
+def create_notification_backend(name, tray_icon):
+    """按名称创建系统通知后端，auto 时按平台选择"""
+    if name == "auto":
+        name = "osascript" if platform.system() == "Darwin" else "tray"
+
+    if name == "osascript":
+        backend = OsascriptBackend()
+    elif name == "notify-send":
+        backend = NotifySendBackend()
+    elif name == "none":
+        return NullBackend()
+    elif name == "recording":
+        return RecordingBackend()
+    else:
+        return TrayMessageBackend(tray_icon)
+
+    if not backend.available():
+        logging.warning(f"系统通知后端 {name} 不可用，改用托盘气泡通知")
+        return TrayMessageBackend(tray_icon)
+    return backend
+
+class NotificationDispatcher:
+    """系统通知分发器
+
+    GUI线程只负责把通知放入有界队列，由后台线程调用后端发送。队列满或超过后端限速时直接丢弃，
+    弹窗和历史记录不受影响；丢弃的条数在没有新通知、后端又可以发送时汇总为一条通知补发。
+    """
+    SUMMARY_TITLE = "NotifyPI"
+
+    def __init__(self, backend, queue_size=100):
+        self.backend = backend
+        self.bucket = TokenBucket(backend.rate, backend.burst)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = 0
+        self.rate_limited = 0
+        self.summarized = 0  # 已在汇总通知中报告过的丢弃数
+        self._thread = threading.Thread(target=self._run, name="NotificationDispatcher", daemon=True)
+        self._thread.start()
+
+    def set_backend(self, backend):
+        self.backend = backend
+        self.bucket = TokenBucket(backend.rate, backend.burst)
+
+    def dispatch(self, title, message):
+        try:
+            self.queue.put_nowait((title, message))
+        except queue.Full:
+            self.dropped += 1
+
+    def _unreported(self):
+        return self.dropped + self.rate_limited - self.summarized
+
+    def _run(self):
+        while True:
+            # 有未报告的丢弃时最多等到后端可以再发送一条，期间没有新通知就发出汇总
+            timeout = self.bucket.retry_after() if self._unreported() else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._send_summary()
+                continue
+            if item is None:
+                break
+            backend, bucket = self.backend, self.bucket
+            if not bucket.consume():
+                self.rate_limited += 1
+                continue
+            self._send(backend, *item)
+
+    def _send_summary(self):
+        backend, bucket = self.backend, self.bucket
+        if not bucket.consume():
+            return
+        count = self._unreported()
+        self.summarized += count
+        self._send(backend, self.SUMMARY_TITLE, f"另有 {count} 条通知未显示")
 
+    def _send(self, backend, title, message):
         try:
-            data = json.loads(post_data.decode('utf-8'))
-            title = data.get('title', '通知')
-            message = data.get('message', '这是一条通知消息')
-            timestamp = data.get('timestamp', None)
-
-            self.server.status_bar_app.notification_received.emit(title, message, timestamp)
-
-            response = json.dumps({
-                "status": "success",
-                "message": "通知已发送",
-                "data": {
-                    "title": title,
-                    "message": message,
-                    "timestamp": timestamp
-                }
-            })
-            self._set_response("application/json")
-            self.wfile.write(response.encode('utf-8'))
+            backend.send(title, message)
         except Exception as e:
-            response = json.dumps({
-                "status": "error",
-                "message": str(e),
-                "details": "请确保发送的是有效的JSON格式，包含title和message字段"
-            })
-            self._set_response("application/json")
-            self.wfile.write(response.encode('utf-8'))
+            logging.error(f"系统通知发送失败({backend.name}): {str(e)}")
 
-    def log_message(self, format, *args):
-        return
+    def stop(self):
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            # 队列已满时丢弃待发送的通知，保证能退出
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+        self._thread.join(1)
 
 class NotificationPopup(QWidget):
-    def __init__(self, title, message, parent=None):
+    """可复用的通知弹窗，控件和样式只在创建时构建一次，之后通过 set_content 更新内容"""
+    dismissed = Signal(object)
+
+    DISPLAY_TIME = 5000  # 毫秒
+    FADE_TIME = 500  # 毫秒
+    STYLE_SHEET = """
+        QWidget {
+            background-color: rgba(255, 255, 255, 240);
+            border: 1px solid #cccccc;
+            border-radius: 5px;
+            padding: 10px;
+        }
+        QLabel {
+            color: #333333;
+        }
+        QPushButton {
+            background-color: #4a86e8;
+            color: white;
+            border: none;
+            padding: 5px 10px;
+            border-radius: 3px;
+        }
+        QPushButton:hover {
+            background-color: #3a76d8;
+        }
+    """
+
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.title = title
-        self.message = message
+        self.title = ""
+        self.message = ""
+        self.count = 1  # 弹窗代表的通知条数，合并展示时大于1
         self.setWindowFlags(
             Qt.FramelessWindowHint |
             Qt.WindowStaysOnTopHint |
@@ -83,122 +263,370 @@ class NotificationPopup(QWidget):
         )
         self.setAttribute(Qt.WA_TranslucentBackground)
         self.setup_ui()
+
         self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.fade_out)
-        self.timer.start(5000)
-        self.opacity = 1.0
+
+        # 通过窗口透明度做淡出动画，由合成器完成，不需要反复重绘控件
+        self.fade_animation = QPropertyAnimation(self, b"windowOpacity", self)
+        self.fade_animation.setDuration(self.FADE_TIME)
+        self.fade_animation.setStartValue(1.0)
+        self.fade_animation.setEndValue(0.0)
+        self.fade_animation.finished.connect(self.dismiss)
 
     def setup_ui(self):
         main_layout = QVBoxLayout(self)
         main_layout.setContentsMargins(10, 10, 10, 10)
         main_layout.setSpacing(5)
 
-        title_label = QLabel(self.title)
+        self.title_label = QLabel()
         title_font = QFont()
         title_font.setBold(True)
         title_font.setPointSize(12)
-        title_label.setFont(title_font)
+        self.title_label.setFont(title_font)
 
-        message_label = QLabel(self.message)
-        message_label.setWordWrap(True)
-        message_label.setMaximumWidth(300)
+        self.message_label = QLabel()
+        self.message_label.setWordWrap(True)
+        self.message_label.setMaximumWidth(300)
+
+        self.overflow_label = QLabel()
+        self.overflow_label.hide()
 
         button_layout = QHBoxLayout()
         view_button = QPushButton("查看")
         view_button.clicked.connect(self.view_notification)
         close_button = QPushButton("关闭")
-        close_button.clicked.connect(self.close)
+        close_button.clicked.connect(self.dismiss)
         button_layout.addWidget(view_button)
         button_layout.addWidget(close_button)
 
-        main_layout.addWidget(title_label)
-        main_layout.addWidget(message_label)
+        main_layout.addWidget(self.title_label)
+        main_layout.addWidget(self.message_label)
+        main_layout.addWidget(self.overflow_label)
         main_layout.addLayout(button_layout)
 
-        self.setStyleSheet("""
-            QWidget {
-                background-color: rgba(255, 255, 255, 240);
-                border: 1px solid #cccccc;
-                border-radius: 5px;
-                padding: 10px;
-            }
-            QLabel {
-                color: #333333;
-            }
-            QPushButton {
-                background-color: #4a86e8;
-                color: white;
-                border: none;
-                padding: 5px 10px;
-                border-radius: 3px;
-            }
-            QPushButton:hover {
-                background-color: #3a76d8;
-            }
-        """)
+        self.setStyleSheet(self.STYLE_SHEET)
+
+    def set_content(self, title, message, overflow=0, count=1):
+        self.title = title
+        self.message = message
+        self.count = count
+        self.title_label.setText(title)
+        self.message_label.setText(message)
+        self.overflow_label.setText(f"另有 {overflow} 条通知未显示")
+        self.overflow_label.setVisible(overflow > 0)
         self.adjustSize()
 
+        self.fade_animation.stop()
+        self.setWindowOpacity(1.0)
+        self.timer.start(self.DISPLAY_TIME)
+
     def view_notification(self):
+        # 先关闭弹窗交还给 PopupManager，对话框打开期间它可能被复用来显示新通知
+        title, message = self.title, self.message
+        self.dismiss()
         msg_box = QMessageBox()
-        msg_box.setWindowTitle(self.title)
-        msg_box.setText(self.message)
+        msg_box.setWindowTitle(title)
+        msg_box.setText(message)
         msg_box.setIcon(QMessageBox.Information)
         msg_box.exec()
-        self.close()
 
     def fade_out(self):
-        self.opacity -= 0.1
-        if self.opacity <= 0:
-            self.close()
-        else:
-            palette = self.palette()
-            bg_color = palette.color(QPalette.Window)
-            bg_color.setAlphaF(self.opacity)
-            palette.setColor(QPalette.Window, bg_color)
-            self.setPalette(palette)
-            QTimer.singleShot(50, self.fade_out)
-
-    def show_at_position(self, position):
-        screen_geometry = QApplication.primaryScreen().geometry()
-        popup_width = self.width()
-        popup_height = self.height()
+        self.fade_animation.start()
+
+    def dismiss(self):
+        self.timer.stop()
+        self.fade_animation.stop()
+        if self.isVisible():
+            self.hide()
+            self.dismissed.emit(self)
 
-        x = position.x() - popup_width // 2
-        if x < 0:
-            x = 0
-        elif x + popup_width > screen_geometry.width():
-            x = screen_geometry.width() - popup_width
+class PopupManager(QObject):
+    """通知弹窗管理
+
+    预先创建一组弹窗并循环复用，最多同时堆叠显示 max_visible 个。
+    超出时复用最早的弹窗，并在最新弹窗中显示被挤掉的通知数量（合并展示的弹窗按其代表的条数计算）。
+    """
+    SPACING = 8
+
+    def __init__(self, max_visible=3, parent=None):
+        super().__init__(parent)
+        self.max_visible = max_visible
+        self.free = []
+        self.visible = []  # 从旧到新
+        self.overflow = 0
+        self.anchor = QPoint()
+        self._ensure_pool()
+
+    def _ensure_pool(self):
+        while len(self.free) + len(self.visible) < self.max_visible:
+            popup = NotificationPopup()
+            popup.dismissed.connect(self._on_dismissed)
+            self.free.append(popup)
+
+    def set_max_visible(self, max_visible):
+        self.max_visible = max(max_visible, 1)
+        # 上限调低时关闭多出的旧弹窗，并释放多余的空闲弹窗
+        for popup in self.visible[:len(self.visible) - self.max_visible]:
+            popup.dismiss()
+        while self.free and len(self.free) + len(self.visible) > self.max_visible:
+            self.free.pop().deleteLater()
+        self._ensure_pool()
+
+    def show(self, title, message, anchor, count=1):
+        """显示弹窗，count 为它代表的通知条数"""
+        self.anchor = anchor
+        if self.free and len(self.visible) < self.max_visible:
+            popup = self.free.pop()
+        else:
+            popup = self.visible.pop(0)
+            self.overflow += popup.count
+
+        popup.set_content(title, message, self.overflow, count)
+        self.visible.append(popup)
+        self._layout()
+        popup.show()
+
+    def _on_dismissed(self, popup):
+        if popup in self.visible:
+            self.visible.remove(popup)
+            if len(self.free) + len(self.visible) < self.max_visible:
+                self.free.append(popup)
+            else:
+                popup.deleteLater()
+        if not self.visible:
+            self.overflow = 0
+        self._layout()
 
-        y = position.y() + 20
-        if y + popup_height > screen_geometry.height():
-            y = screen_geometry.height() - popup_height
+    def _layout(self):
+        """最新的弹窗靠近托盘图标，较早的依次向外排列"""
+        screen_geometry = QApplication.primaryScreen().geometry()
+        stack_up = self.anchor.y() > screen_geometry.height() // 2
+
+        y = self.anchor.y() - 20 if stack_up else self.anchor.y() + 20
+        for popup in reversed(self.visible):
+            width = popup.width()
+            height = popup.height()
+            x = min(max(self.anchor.x() - width // 2, 0), screen_geometry.width() - width)
+            if stack_up:
+                top = y - height
+                y = top - self.SPACING
+            else:
+                top = min(y, screen_geometry.height() - height)
+                y = top + height + self.SPACING
+            popup.move(x, top)
+
+    def close_all(self):
+        for popup in list(self.visible):
+            popup.dismiss()
+
+def read_lines_before(path, end, count, block_size=65536):
+    """从文件的 end 偏移处向前读取最多 count 行，返回 (行列表, 第一行的起始偏移)
+
+    只读取需要的尾部数据块，适用于很大的日志文件。
+    """
+    with open(path, "rb") as f:
+        position = end
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    lines = data.split(b"\n")
+    if position > 0:
+        # 第一行可能不完整，丢弃
+        position += len(lines[0]) + 1
+        lines = lines[1:]
+    if lines and lines[-1] == b"":
+        lines.pop()
+    if len(lines) > count:
+        skipped = lines[:-count]
+        position += sum(len(line) + 1 for line in skipped)
+        lines = lines[-count:]
+    return [line.decode("utf-8", errors="replace") for line in lines], position
+
+class LogIndex:
+    """日志文件的轻量偏移索引，用于按级别、事件和时间范围过滤
+
+    每条日志只保存起始偏移、时间、级别和事件编号，文件增长时只索引新增的部分。
+    同时识别文本格式和 JSON Lines 格式；异常堆栈等续行归入上一条日志。
+    索引按 (st_dev, st_ino) 缓存，日志轮转重命名后仍可继续使用。
+    """
+    LEVELS = {b"DEBUG": 1, b"INFO": 2, b"WARNING": 3, b"ERROR": 4, b"CRITICAL": 5}
+    TEXT_PATTERN = re.compile(rb"(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) - ([A-Z]+) - ")
+    JSON_PATTERN = re.compile(rb'\{"ts": "(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)", "level": "([A-Z]+)", "event": "([^"\\]*)"')
+    HEAD_SIZE = 64
+
+    _cache = {}
 
-        self.move(x, y)
-        self.show()
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.offsets = array("q")
+        self.times = array("q")  # YYYYmmddHHMMSS 形式的整数
+        self.levels = bytearray()
+        self.events = array("H")
+        self.event_names = []
+        self.event_ids = {}
+        self.end = 0
+        self.head = b""
+
+    @classmethod
+    def for_files(cls, paths):
+        """返回 [(path, index)]，不存在的文件跳过；paths 应包含全部日志文件，其余缓存会被清理"""
+        indexes = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                file_id = (stat.st_dev, stat.st_ino)
+                index = cls._cache.get(file_id) or cls()
+                index.update(path)
+            except OSError:
+                continue
+            indexes[file_id] = (path, index)
+        cls._cache = {file_id: index for file_id, (path, index) in indexes.items()}
+        return list(indexes.values())
+
+    def update(self, path):
+        """索引文件新增的完整行"""
+        with open(path, "rb") as f:
+            head = f.read(self.HEAD_SIZE)
+            size = os.fstat(f.fileno()).st_size
+            # 文件被截断或被替换成别的内容时重建索引
+            if size < self.end or not head.startswith(self.head):
+                self._reset()
+            if not self.head:
+                self.head = head
+            if size == self.end:
+                return
+            f.seek(self.end)
+            position = self.end
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 正在写入的半行留到下次
+                self._index_line(line, position)
+                position += len(line)
+            self.end = position
+
+    def _index_line(self, line, position):
+        match = self.TEXT_PATTERN.match(line)
+        event = b"log"
+        if not match:
+            match = self.JSON_PATTERN.match(line)
+            if not match:
+                return
+            event = match.group(3)
+        level = self.LEVELS.get(match.group(2))
+        if level is None:
+            return
+        event_id = self.event_ids.get(event)
+        if event_id is None:
+            event_id = self.event_ids[event] = len(self.event_names)
+            self.event_names.append(event.decode("utf-8", errors="replace"))
+        ts = match.group(1)
+        self.offsets.append(position)
+        self.times.append(int(ts[0:4] + ts[5:7] + ts[8:10] + ts[11:13] + ts[14:16] + ts[17:19]))
+        self.levels.append(level)
+        self.events.append(event_id)
+
+    def query(self, min_level=None, event=None, start=None, end=None, since=0, limit=None):
+        """按条件查找日志，返回 (起始偏移, 结束偏移) 列表，最新的在前
+
+        start/end 为 YYYYmmddHHMMSS 形式的整数，日志按时间顺序写入，因此可以二分定位。
+        """
+        low = bisect.bisect_left(self.times, start) if start is not None else 0
+        low = max(low, bisect.bisect_left(self.offsets, since))
+        high = bisect.bisect_right(self.times, end) if end is not None else len(self.offsets)
+        min_level = self.LEVELS.get(min_level.encode(), 0) if min_level else 0
+        event_id = self.event_ids.get(event.encode()) if event else None
+        if event and event_id is None:
+            return []
+
+        ranges = []
+        for i in range(high - 1, low - 1, -1):
+            if self.levels[i] < min_level or (event_id is not None and self.events[i] != event_id):
+                continue
+            stop = self.offsets[i + 1] if i + 1 < len(self.offsets) else self.end
+            ranges.append((self.offsets[i], stop))
+            if limit and len(ranges) >= limit:
+                break
+        return ranges
 
 class LogViewerDialog(QDialog):
+    """日志查看器
+
+    打开时只从文件尾部读取最近的日志，之后由 QFileSystemWatcher 通知增量读取；
+    可以按需向前翻页，读完当前文件后继续读取轮转的 app.log.1..N 备份。
+    按级别、事件和时间范围筛选时通过 LogIndex 查找，不必重新扫描整个文件。
+    """
+    TAIL_LINES = 1000
+    PAGE_LINES = 1000
+    MAX_ROTATED_FILES = 5
+    FILTER_LIMIT = 2000
+    TITLE = "应用运行日志"
+
     def __init__(self, log_file, parent=None):
         super().__init__(parent)
-        self.setWindowTitle("应用运行日志")
-        self.setMinimumSize(600, 400)
+        self.setWindowTitle(self.TITLE)
+        self.setMinimumSize(760, 400)
         self.log_file = log_file
         self.last_position = 0
-        self.last_refresh_time = 0
-        self.MIN_REFRESH_INTERVAL = 0.5  # 秒
-        self.MAX_LOG_LINES = 1000
+        self.file_id = None
+        self.older_file_index = 0  # 0 表示当前日志文件，n 表示 app.log.n
+        self.older_offset = 0
+        self.refresh_pending = False
+        self.log_filter = None
         self.setup_ui()
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
 
-        # 日志显示区域
-        self.log_text = QTextBrowser()
+        # 筛选条件
+        filter_layout = QHBoxLayout()
+        self.level_combo = QComboBox()
+        self.level_combo.addItem("全部级别", None)
+        for level in ("DEBUG", "INFO", "WARNING", "ERROR"):
+            self.level_combo.addItem(f"{level} 及以上", level)
+        self.event_combo = QComboBox()
+        self.event_combo.addItem("全部事件", None)
+        self.event_combo.setToolTip("事件类型只记录在 JSON Lines 格式的日志中")
+        self.time_range_check = QCheckBox("时间范围")
+        now = QDateTime.currentDateTime()
+        self.start_edit = QDateTimeEdit(now.addSecs(-3600))
+        self.end_edit = QDateTimeEdit(now)
+        for edit in (self.start_edit, self.end_edit):
+            edit.setDisplayFormat("yyyy-MM-dd HH:mm:ss")
+            edit.setCalendarPopup(True)
+        filter_button = QPushButton("筛选")
+        filter_button.clicked.connect(self.apply_filter)
+        clear_filter_button = QPushButton("清除筛选")
+        clear_filter_button.clicked.connect(self.clear_filter)
+
+        filter_layout.addWidget(self.level_combo)
+        filter_layout.addWidget(self.event_combo)
+        filter_layout.addWidget(self.time_range_check)
+        filter_layout.addWidget(self.start_edit)
+        filter_layout.addWidget(QLabel("至"))
+        filter_layout.addWidget(self.end_edit)
+        filter_layout.addWidget(filter_button)
+        filter_layout.addWidget(clear_filter_button)
+        filter_layout.addStretch()
+
+        # 日志显示区域：纯文本控件，超过最大行数时自动丢弃最早的行
+        self.log_text = QPlainTextEdit()
         self.log_text.setReadOnly(True)
         self.log_text.setFont(QFont("Courier New", 10))
-        self.log_text.setLineWrapMode(QTextEdit.NoWrap)
+        self.log_text.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.log_text.setMaximumBlockCount(self.TAIL_LINES)
 
         # 控制按钮
         button_layout = QHBoxLayout()
+        self.older_button = QPushButton("加载更早日志")
+        self.older_button.clicked.connect(self.load_older)
         self.refresh_button = QPushButton("刷新")
         self.refresh_button.clicked.connect(self.manual_refresh)
         self.auto_refresh_check = QCheckBox("自动刷新")
@@ -209,80 +637,251 @@ class LogViewerDialog(QDialog):
         close_button = QPushButton("关闭")
         close_button.clicked.connect(self.close)
 
+        button_layout.addWidget(self.older_button)
         button_layout.addWidget(self.refresh_button)
         button_layout.addWidget(self.auto_refresh_check)
         button_layout.addWidget(clear_button)
         button_layout.addStretch()
         button_layout.addWidget(close_button)
 
+        layout.addLayout(filter_layout)
         layout.addWidget(self.log_text)
         layout.addLayout(button_layout)
 
-        # 设置定时器用于自动刷新
-        self.refresh_timer = QTimer(self)
-        self.refresh_timer.timeout.connect(self.auto_refresh)
-        self.refresh_timer.start(1000)
+        # 监听日志文件及其目录（轮转时文件会被重命名后重新创建）
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.schedule_refresh)
+        self.watcher.directoryChanged.connect(self.schedule_refresh)
+        self.toggle_auto_refresh(Qt.Checked)
 
-        # 初始加载日志
+        # 初始加载日志，事件列表在窗口显示后再建立索引
         self.manual_refresh()
+        QTimer.singleShot(0, self.refresh_event_choices)
 
     def toggle_auto_refresh(self, state):
-        if state == Qt.Checked:
-            self.refresh_timer.start(1000)
-        else:
-            self.refresh_timer.stop()
+        paths = [self.log_file, os.path.dirname(self.log_file)]
+        if Qt.CheckState(state) == Qt.Checked:
+            self.watcher.addPaths([path for path in paths if os.path.exists(path)])
+            self.schedule_refresh()
+        elif self.watcher.files() or self.watcher.directories():
+            self.watcher.removePaths(self.watcher.files() + self.watcher.directories())
+
+    def schedule_refresh(self, *args):
+        """同一轮事件循环内的多次文件变化只触发一次读取"""
+        if not self.refresh_pending:
+            self.refresh_pending = True
+            QTimer.singleShot(100, self.auto_refresh)
 
     def manual_refresh(self):
-        self.last_position = 0
+        """重新从文件尾部加载最近的日志"""
+        if self.log_filter:
+            self.load_filtered()
+            return
         self.log_text.clear()
-        self.auto_refresh()
+        self.log_text.setMaximumBlockCount(self.TAIL_LINES)
+        self.older_file_index = 0
+        try:
+            if not os.path.exists(self.log_file):
+                open(self.log_file, 'a').close()
+            end = self._complete_size(self.log_file)
+            lines, self.older_offset = read_lines_before(self.log_file, end, self.TAIL_LINES)
+            self.last_position = end
+            self.file_id = self._file_id(self.log_file)
+            if lines:
+                self.log_text.setPlainText("\n".join(lines))
+            self._scroll_to_bottom()
+        except OSError as e:
+            self.log_text.appendPlainText(f"读取日志错误: {str(e)}")
+        self.older_button.setEnabled(True)
 
     def auto_refresh(self):
-        """自动刷新日志，只读取新增内容"""
-        now = time.time()
-        if now - self.last_refresh_time < self.MIN_REFRESH_INTERVAL:
-            return
-        self.last_refresh_time = now
+        """只读取新增内容"""
+        self.refresh_pending = False
+        if self.auto_refresh_check.isChecked() and self.log_file not in self.watcher.files() \
+                and os.path.exists(self.log_file):
+            self.watcher.addPath(self.log_file)
 
         try:
-            # 检查文件是否存在
             if not os.path.exists(self.log_file):
-                # 尝试创建文件
-                open(self.log_file, 'a').close()
                 return
 
-            current_size = os.path.getsize(self.log_file)
-            if current_size < self.last_position:
+            file_id = self._file_id(self.log_file)
+            if file_id != self.file_id:
+                # 文件已轮转：先读完旧文件（现在是 app.log.1）剩余的部分，再从新文件开头读
+                rotated_file = f"{self.log_file}.1"
+                if os.path.exists(rotated_file) and self._file_id(rotated_file) == self.file_id:
+                    self._append_from(rotated_file, self.last_position)
+                    self.older_file_index += 1
+                self.file_id = file_id
+                self.last_position = 0
+            elif os.path.getsize(self.log_file) < self.last_position:
                 # 文件被截断，重置
                 self.last_position = 0
-                self.log_text.clear()
 
-            if current_size > self.last_position:
-                with open(self.log_file, "r", encoding="utf-8") as f:
-                    f.seek(self.last_position)
-                    new_content = f.read()
-                    self.last_position = f.tell()
-
-                    if new_content:
-                        # 添加新内容
-                        self.log_text.append(new_content)
-
-                        # 限制行数
-                        lines = self.log_text.document().blockCount()
-                        if lines > self.MAX_LOG_LINES:
-                            cursor = QTextCursor(self.log_text.document())
-                            cursor.movePosition(QTextCursor.Start)
-                            cursor.movePosition(QTextCursor.Down, QTextCursor.KeepAnchor, lines - self.MAX_LOG_LINES)
-                            cursor.removeSelectedText()
-
-                        # 滚动到底部
-                        scroll_bar = self.log_text.verticalScrollBar()
-                        if scroll_bar:
-                            scroll_bar.setValue(scroll_bar.maximum())
-        except Exception as e:
-            current_content = self.log_text.toPlainText()
-            if "读取日志错误" not in current_content[-100:]:  # 只检查最后100个字符
-                self.log_text.append(f"读取日志错误: {str(e)}")
+            self.last_position = self._append_from(self.log_file, self.last_position)
+        except OSError as e:
+            self.log_text.appendPlainText(f"读取日志错误: {str(e)}")
+
+    def _append_from(self, path, position):
+        """追加 path 从 position 开始的完整行，返回新的读取位置；筛选时只追加匹配的日志"""
+        if self.log_filter:
+            index = dict(LogIndex.for_files(self._log_files())).get(path)
+            if index is None:
+                return position
+            ranges = index.query(since=position, **self.log_filter)
+            text = "\n".join(self._read_ranges(path, reversed(ranges)))
+            end = index.end
+        else:
+            end = self._complete_size(path)
+            if end <= position:
+                return position
+            with open(path, "rb") as f:
+                f.seek(position)
+                text = f.read(end - position).rstrip(b"\n").decode("utf-8", errors="replace")
+        if not text:
+            return end
+
+        scroll_bar = self.log_text.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 2
+        self.log_text.appendPlainText(text)
+        if at_bottom:
+            self._scroll_to_bottom()
+        return end
+
+    def load_older(self):
+        """向前加载一页日志，当前文件读完后继续读取轮转的备份文件"""
+        if self.log_filter:
+            return
+        while self.older_offset <= 0:
+            if self.older_file_index >= self.MAX_ROTATED_FILES:
+                self.older_button.setEnabled(False)
+                return
+            self.older_file_index += 1
+            path = f"{self.log_file}.{self.older_file_index}"
+            if os.path.exists(path):
+                self.older_offset = os.path.getsize(path)
+
+        path = self.log_file if self.older_file_index == 0 else f"{self.log_file}.{self.older_file_index}"
+        try:
+            lines, self.older_offset = read_lines_before(path, self.older_offset, self.PAGE_LINES)
+        except OSError as e:
+            QMessageBox.warning(self, "日志", f"读取日志失败: {str(e)}")
+            return
+        if not lines:
+            return
+
+        scroll_bar = self.log_text.verticalScrollBar()
+        distance_from_bottom = scroll_bar.maximum() - scroll_bar.value()
+
+        self.log_text.setMaximumBlockCount(self.log_text.maximumBlockCount() + len(lines))
+        cursor = QTextCursor(self.log_text.document())
+        cursor.movePosition(QTextCursor.Start)
+        cursor.insertText("\n".join(lines) + "\n")
+
+        scroll_bar.setValue(scroll_bar.maximum() - distance_from_bottom)
+
+    def apply_filter(self):
+        level = self.level_combo.currentData()
+        event = self.event_combo.currentData()
+        start = end = None
+        if self.time_range_check.isChecked():
+            start = int(self.start_edit.dateTime().toString("yyyyMMddHHmmss"))
+            end = int(self.end_edit.dateTime().toString("yyyyMMddHHmmss"))
+        if not level and not event and start is None:
+            self.clear_filter()
+            return
+        self.log_filter = {"min_level": level, "event": event, "start": start, "end": end}
+        self.load_filtered()
+
+    def clear_filter(self):
+        self.log_filter = None
+        self.setWindowTitle(self.TITLE)
+        self.manual_refresh()
+
+    def load_filtered(self):
+        """在当前文件和轮转备份中查找匹配的日志，按时间顺序显示最新的 FILTER_LIMIT 条"""
+        entries = []
+        try:
+            indexes = LogIndex.for_files(self._log_files())
+            for path, index in indexes:
+                ranges = index.query(limit=self.FILTER_LIMIT - len(entries), **self.log_filter)
+                entries.extend(self._read_ranges(path, ranges))
+                if len(entries) >= self.FILTER_LIMIT:
+                    break
+            self._set_event_choices(indexes)
+            if os.path.exists(self.log_file):
+                self.file_id = self._file_id(self.log_file)
+                self.last_position = dict(indexes).get(self.log_file, LogIndex()).end
+        except OSError as e:
+            QMessageBox.warning(self, "日志", f"读取日志失败: {str(e)}")
+            return
+
+        self.log_text.clear()
+        self.log_text.setMaximumBlockCount(0)
+        self.log_text.setPlainText("\n".join(reversed(entries)))
+        self._scroll_to_bottom()
+        self.older_button.setEnabled(False)
+        suffix = "（仅显示最新的部分）" if len(entries) >= self.FILTER_LIMIT else ""
+        self.setWindowTitle(f"{self.TITLE} - 筛选出 {len(entries)} 条{suffix}")
+
+    def refresh_event_choices(self):
+        try:
+            self._set_event_choices(LogIndex.for_files(self._log_files()))
+        except OSError:
+            pass
+
+    def _set_event_choices(self, indexes):
+        events = sorted({name for path, index in indexes for name in index.event_names})
+        current = self.event_combo.currentData()
+        if events == [self.event_combo.itemData(i) for i in range(1, self.event_combo.count())]:
+            return
+        self.event_combo.blockSignals(True)
+        self.event_combo.clear()
+        self.event_combo.addItem("全部事件", None)
+        for event in events:
+            self.event_combo.addItem(event, event)
+        self.event_combo.setCurrentIndex(max(self.event_combo.findData(current), 0))
+        self.event_combo.blockSignals(False)
+
+    def _log_files(self):
+        """当前日志文件和轮转备份，最新的在前"""
+        return [self.log_file] + [f"{self.log_file}.{i}" for i in range(1, self.MAX_ROTATED_FILES + 1)]
+
+    @staticmethod
+    def _read_ranges(path, ranges):
+        entries = []
+        with open(path, "rb") as f:
+            for start, stop in ranges:
+                f.seek(start)
+                entries.append(f.read(stop - start).rstrip(b"\n").decode("utf-8", errors="replace"))
+        return entries
+
+    @staticmethod
+    def _file_id(path):
+        stat = os.stat(path)
+        return (stat.st_dev, stat.st_ino)
+
+    @staticmethod
+    def _complete_size(path):
+        """返回最后一个换行符之后的位置，正在写入的半行留到下次读取"""
+        size = os.path.getsize(path)
+        if size == 0:
+            return 0
+        with open(path, "rb") as f:
+            position = size
+            while position > 0:
+                read_size = min(4096, position)
+                f.seek(position - read_size)
+                block = f.read(read_size)
+                index = block.rfind(b"\n")
+                if index >= 0:
+                    return position - read_size + index + 1
+                position -= read_size
+        return 0
+
+    def _scroll_to_bottom(self):
+        scroll_bar = self.log_text.verticalScrollBar()
+        scroll_bar.setValue(scroll_bar.maximum())
 
     def clear_log(self):
         """清空日志文件"""
@@ -297,6 +896,7 @@ class LogViewerDialog(QDialog):
                 with open(self.log_file, "w", encoding="utf-8") as f:
                     f.write("")
                 self.last_position = 0
+                self.older_offset = 0
                 self.log_text.clear()
             except Exception as e:
                 QMessageBox.critical(
@@ -304,7 +904,168 @@ class LogViewerDialog(QDialog):
                     f"清空日志失败: {str(e)}"
                 )
 
+class HistoryListModel(QAbstractListModel):
+    """通知历史列表模型，按需从 HistoryStore 分页加载"""
+    PAGE_SIZE = 200
+    NotificationRole = Qt.UserRole + 1
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.rows = []  # 按id从大到小排列
+        self.exhausted = False
+        self.bold_font = QFont()
+        self.bold_font.setBold(True)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        notification = self.rows[index.row()]
+
+        if role == Qt.DisplayRole:
+            message = notification["message"].splitlines()[0] if notification["message"] else ""
+            if len(message) > 80:
+                message = message[:80] + "..."
+            read_status = "" if notification["read"] else " [未读]"
+            return f"[{notification['timestamp']}] {notification['title']}: {message}{read_status}"
+        if role == Qt.FontRole and not notification["read"]:
+            return self.bold_font
+        if role == Qt.ToolTipRole:
+            return f"来源: {notification['source']}\n{notification['message']}"
+        if role == self.NotificationRole:
+            return notification
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        before_id = self.rows[-1]["id"] if self.rows else None
+        page = self.store.fetch_page(before_id, self.PAGE_SIZE)
+        if len(page) < self.PAGE_SIZE:
+            self.exhausted = True
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.endInsertRows()
+
+    def prepend(self, notifications):
+        """新到达的通知插入到顶部（notifications 按到达顺序排列）"""
+        if not notifications:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(notifications) - 1)
+        self.rows[0:0] = [dict(n) for n in reversed(notifications)]
+        self.endInsertRows()
+
+    def mark_read(self, notification_id):
+        row = self._find_row(notification_id)
+        if row is not None and not self.rows[row]["read"]:
+            self.rows[row]["read"] = True
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def mark_all_read(self):
+        for notification in self.rows:
+            notification["read"] = True
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1))
+
+    def _find_row(self, notification_id):
+        # rows 按id降序排列，取负数后二分查找
+        keys = _DescendingIds(self.rows)
+        row = bisect.bisect_left(keys, -notification_id)
+        if row < len(self.rows) and self.rows[row]["id"] == notification_id:
+            return row
+        return None
+
+class _DescendingIds:
+    """把按id降序排列的通知列表包装成可二分查找的升序序列"""
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, i):
+        return -self.rows[i]["id"]
+
+class HistoryWindow(QDialog):
+    notification_activated = Signal(dict)
+    mark_all_requested = Signal()
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("消息历史")
+        self.setMinimumSize(600, 400)
+        self.model = HistoryListModel(store, self)
+
+        layout = QVBoxLayout(self)
+
+        # 只渲染可见行，统一行高避免逐行测量
+        self.list_view = QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setLayoutMode(QListView.Batched)
+        self.list_view.setBatchSize(100)
+        self.list_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.list_view.setModel(self.model)
+        self.list_view.activated.connect(self.on_activated)
+
+        self.count_label = QLabel()
+
+        button_layout = QHBoxLayout()
+        mark_read_button = QPushButton("标记所有为已读")
+        mark_read_button.clicked.connect(self.mark_all_requested.emit)
+        close_button = QPushButton("关闭")
+        close_button.clicked.connect(self.close)
+        button_layout.addWidget(self.count_label)
+        button_layout.addStretch()
+        button_layout.addWidget(mark_read_button)
+        button_layout.addWidget(close_button)
+
+        layout.addWidget(self.list_view)
+        layout.addLayout(button_layout)
+
+        self.update_count()
+
+    def update_count(self):
+        store = self.model.store
+        self.count_label.setText(f"消息数量: {store.total_count} (未读: {store.unread_count})")
+
+    def on_activated(self, index):
+        notification = index.data(HistoryListModel.NotificationRole)
+        if notification:
+            self.notification_activated.emit(dict(notification))
+
 class SettingsDialog(QDialog):
+    NATIVE_BACKENDS = [
+        ("auto", "自动"),
+        ("osascript", "macOS 通知中心"),
+        ("notify-send", "notify-send (Linux)"),
+        ("tray", "托盘气泡"),
+        ("none", "不显示")
+    ]
+    SOURCE_MODES = [
+        ("poll", "定时轮询"),
+        ("sse", "SSE推送"),
+        ("longpoll", "长轮询")
+    ]
+    SOURCE_COLUMNS = [
+        ("name", "名称"),
+        ("url", "API URL"),
+        ("mode", "模式"),
+        ("interval", "间隔(秒)"),
+        ("timeout", "超时(秒)"),
+        ("headers", "请求头(JSON)"),
+        ("cursor_param", "游标参数"),
+        ("enabled", "启用")
+    ]
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("设置")
@@ -314,9 +1075,9 @@ class SettingsDialog(QDialog):
             Qt.Dialog |
             Qt.WindowCloseButtonHint
         )
-        self.setFixedSize(500, 350)
+        self.setFixedSize(720, 790)
 
-        self.settings = QSettings("PiApp", "NotificationApp")
+        self.settings = app_settings()
 
         layout = QVBoxLayout(self)
         layout.setContentsMargins(10, 10, 10, 10)  # 设置边距
@@ -331,6 +1092,72 @@ class SettingsDialog(QDialog):
         self.sound_checkbox.setChecked(self.settings.value("sound_enabled", True, type=bool))
         basic_layout.addRow("音效设置:", self.sound_checkbox)
 
+        self.coalesce_window_spin = QSpinBox()
+        self.coalesce_window_spin.setRange(0, 60000)  # 0表示不合并
+        self.coalesce_window_spin.setSingleStep(100)
+        self.coalesce_window_spin.setValue(self.settings.value("coalesce_window", 1000, type=int))
+        self.coalesce_window_spin.setSuffix(" 毫秒")
+        self.coalesce_window_spin.setToolTip("窗口内到达的多条通知合并为一次弹窗和提示音，0表示不合并")
+        basic_layout.addRow("合并窗口:", self.coalesce_window_spin)
+
+        self.max_popups_spin = QSpinBox()
+        self.max_popups_spin.setRange(1, 10)
+        self.max_popups_spin.setValue(self.settings.value("max_popups", 3, type=int))
+        basic_layout.addRow("最多同时弹窗:", self.max_popups_spin)
+
+        self.native_backend_combo = QComboBox()
+        for backend, label in self.NATIVE_BACKENDS:
+            self.native_backend_combo.addItem(label, backend)
+        backend_index = self.native_backend_combo.findData(self.settings.value("native_backend", "auto"))
+        self.native_backend_combo.setCurrentIndex(max(backend_index, 0))
+        basic_layout.addRow("系统通知:", self.native_backend_combo)
+
+        self.log_format_combo = QComboBox()
+        self.log_format_combo.addItem("文本", "text")
+        self.log_format_combo.addItem("JSON Lines（结构化）", "json")
+        format_index = self.log_format_combo.findData(self.settings.value("log_format", "text"))
+        self.log_format_combo.setCurrentIndex(max(format_index, 0))
+        basic_layout.addRow("日志格式:", self.log_format_combo)
+
+        # 本地接收服务设置组
+        server_group = QGroupBox("本地接收服务（重启后生效）")
+        server_layout = QFormLayout(server_group)
+        server_layout.setFormAlignment(Qt.AlignLeft)
+        server_layout.setFieldGrowthPolicy(QFormLayout.AllNonFixedFieldsGrow)
+
+        self.receiver_engine_combo = QComboBox()
+        self.receiver_engine_combo.addItem("多线程 (HTTP/1.0)", "threading")
+        self.receiver_engine_combo.addItem("asyncio (HTTP/1.1 长连接)", "asyncio")
+        engine_index = self.receiver_engine_combo.findData(
+            self.settings.value("receiver_engine", "threading")
+        )
+        self.receiver_engine_combo.setCurrentIndex(max(engine_index, 0))
+        server_layout.addRow("接收引擎:", self.receiver_engine_combo)
+
+        self.max_connections_spin = QSpinBox()
+        self.max_connections_spin.setRange(1, 10000)
+        self.max_connections_spin.setValue(self.settings.value("max_connections", 100, type=int))
+        server_layout.addRow("最大并发连接:", self.max_connections_spin)
+
+        self.server_port_spin = QSpinBox()
+        self.server_port_spin.setRange(1, 65535)
+        self.server_port_spin.setValue(self.settings.value("server_port", 8000, type=int))
+        server_layout.addRow("端口:", self.server_port_spin)
+
+        self.rate_limit_spin = QSpinBox()
+        self.rate_limit_spin.setRange(0, 100000)  # 0表示不限速
+        self.rate_limit_spin.setValue(self.settings.value("rate_limit", 50, type=int))
+        self.rate_limit_spin.setSuffix(" 条/秒")
+        self.rate_limit_spin.setToolTip("每个客户端每秒允许发送的通知数，可短时突发5秒的量，超出时返回429，0表示不限速")
+        server_layout.addRow("每客户端限速:", self.rate_limit_spin)
+
+        self.ingest_queue_spin = QSpinBox()
+        self.ingest_queue_spin.setRange(10, 1000000)
+        self.ingest_queue_spin.setValue(self.settings.value("ingest_queue_size", 1000, type=int))
+        self.ingest_queue_spin.setSuffix(" 条")
+        self.ingest_queue_spin.setToolTip("等待写入历史的通知超过该数量时返回503")
+        server_layout.addRow("接收队列上限:", self.ingest_queue_spin)
+
         # API设置组
         api_group = QGroupBox("远端API设置")
         api_layout = QFormLayout(api_group)
@@ -342,16 +1169,26 @@ class SettingsDialog(QDialog):
         self.api_enabled_checkbox.stateChanged.connect(self.toggle_api_settings)
         api_layout.addRow("启用状态:", self.api_enabled_checkbox)
 
-        self.api_url_edit = QLineEdit()
-        self.api_url_edit.setPlaceholderText("https://example.com/api/notifications")
-        self.api_url_edit.setText(self.settings.value("api_url", ""))
-        api_layout.addRow("API URL:", self.api_url_edit)
-
-        self.poll_interval_spin = QSpinBox()
-        self.poll_interval_spin.setRange(1, 86400)  # 1秒到24小时
-        self.poll_interval_spin.setValue(self.settings.value("poll_interval", 300, type=int))
-        self.poll_interval_spin.setSuffix(" 秒")
-        api_layout.addRow("轮询间隔:", self.poll_interval_spin)
+        # 数据源列表：每个数据源有独立的间隔、超时、请求头和启用状态
+        self.sources_table = QTableWidget(0, len(self.SOURCE_COLUMNS))
+        self.sources_table.setHorizontalHeaderLabels([label for _, label in self.SOURCE_COLUMNS])
+        self.sources_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.sources_table.verticalHeader().setVisible(False)
+        self.sources_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.sources_table.setMinimumHeight(150)
+        for source in load_poll_sources(self.settings):
+            self.add_source_row(source)
+        api_layout.addRow(self.sources_table)
+
+        self.add_source_button = QPushButton("添加数据源")
+        self.add_source_button.clicked.connect(lambda: self.add_source_row())
+        self.remove_source_button = QPushButton("删除所选")
+        self.remove_source_button.clicked.connect(self.remove_selected_sources)
+        source_button_layout = QHBoxLayout()
+        source_button_layout.addWidget(self.add_source_button)
+        source_button_layout.addWidget(self.remove_source_button)
+        source_button_layout.addStretch()
+        api_layout.addRow(source_button_layout)
 
         self.test_button = QPushButton("测试连接")
         self.test_button.setFixedWidth(100)
@@ -397,6 +1234,7 @@ class SettingsDialog(QDialog):
         button_layout.addWidget(cancel_button)
 
         layout.addWidget(basic_group)
+        layout.addWidget(server_group)
         layout.addWidget(api_group)
         layout.addLayout(button_layout)
 
@@ -406,16 +1244,85 @@ class SettingsDialog(QDialog):
         # 设置整体布局的对齐方式
         layout.setAlignment(Qt.AlignLeft | Qt.AlignTop)
 
+    def add_source_row(self, source=None):
+        source = source or {
+            "name": f"数据源{self.sources_table.rowCount() + 1}",
+            "url": "",
+            "interval": 300,
+            "timeout": 10,
+            "headers": {},
+            "cursor_param": "",
+            "enabled": True,
+            "mode": "poll"
+        }
+        row = self.sources_table.rowCount()
+        self.sources_table.insertRow(row)
+        for column, (key, _) in enumerate(self.SOURCE_COLUMNS):
+            if key == "mode":
+                combo = QComboBox()
+                for mode, label in self.SOURCE_MODES:
+                    combo.addItem(label, mode)
+                combo.setCurrentIndex(max(combo.findData(source.get("mode", "poll")), 0))
+                self.sources_table.setCellWidget(row, column, combo)
+                continue
+            if key == "enabled":
+                item = QTableWidgetItem()
+                item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled | Qt.ItemIsSelectable)
+                item.setCheckState(Qt.Checked if source["enabled"] else Qt.Unchecked)
+            elif key == "headers":
+                item = QTableWidgetItem(json.dumps(source["headers"], ensure_ascii=False) if source["headers"] else "")
+            else:
+                item = QTableWidgetItem(str(source[key]))
+            self.sources_table.setItem(row, column, item)
+
+    def remove_selected_sources(self):
+        rows = sorted({index.row() for index in self.sources_table.selectedIndexes()}, reverse=True)
+        for row in rows:
+            self.sources_table.removeRow(row)
+
+    def collect_sources(self):
+        """读取表格中的数据源配置，格式错误时抛出 ValueError"""
+        sources = []
+        for row in range(self.sources_table.rowCount()):
+            values = {}
+            for column, (key, label) in enumerate(self.SOURCE_COLUMNS):
+                item = self.sources_table.item(row, column)
+                if key == "mode":
+                    values[key] = self.sources_table.cellWidget(row, column).currentData()
+                elif key == "enabled":
+                    values[key] = item.checkState() == Qt.Checked
+                else:
+                    values[key] = item.text().strip() if item else ""
+
+            if not values["url"]:
+                continue
+            try:
+                values["interval"] = max(int(values["interval"] or 300), 1)
+                values["timeout"] = max(int(values["timeout"] or 10), 1)
+                values["headers"] = json.loads(values["headers"]) if values["headers"] else {}
+            except ValueError:
+                raise ValueError(f"第 {row + 1} 行的间隔、超时或请求头格式不正确")
+            if not isinstance(values["headers"], dict):
+                raise ValueError(f"第 {row + 1} 行的请求头必须是JSON对象")
+            values["name"] = values["name"] or values["url"]
+            sources.append(values)
+        return sources
+
     def toggle_api_settings(self):
         enabled = self.api_enabled_checkbox.isChecked()
-        self.api_url_edit.setEnabled(enabled)
-        self.poll_interval_spin.setEnabled(enabled)
+        self.sources_table.setEnabled(enabled)
+        self.add_source_button.setEnabled(enabled)
+        self.remove_source_button.setEnabled(enabled)
         self.test_button.setEnabled(enabled)
 
     def test_connection(self):
-        api_url = self.api_url_edit.text().strip()
+        row = self.sources_table.currentRow()
+        if row < 0 and self.sources_table.rowCount():
+            row = 0
+        item = self.sources_table.item(row, 1) if row >= 0 else None
+        api_url = item.text().strip() if item else ""
         if not api_url:
-            self.show_test_result("请输入API URL", "red")
+            self.show_test_result("请先选择一个填写了API URL的数据源", "red")
             return
 
         self.test_button.setEnabled(False)
@@ -425,6 +1332,7 @@ class SettingsDialog(QDialog):
         QTimer.singleShot(100, lambda: self._perform_test_connection(api_url))
 
     def _perform_test_connection(self, api_url):
+        import requests
         try:
             response = requests.get(api_url, timeout=5)
             if response.status_code == 200:
@@ -457,79 +1365,305 @@ class SettingsDialog(QDialog):
 
     def save_settings(self):
         self.settings.setValue("sound_enabled", self.sound_checkbox.isChecked())
+        self.settings.setValue("coalesce_window", self.coalesce_window_spin.value())
+        self.settings.setValue("native_backend", self.native_backend_combo.currentData())
+        self.settings.setValue("max_popups", self.max_popups_spin.value())
+        self.settings.setValue("log_format", self.log_format_combo.currentData())
+        self.settings.setValue("receiver_engine", self.receiver_engine_combo.currentData())
+        self.settings.setValue("max_connections", self.max_connections_spin.value())
+        self.settings.setValue("server_port", self.server_port_spin.value())
+        self.settings.setValue("rate_limit", self.rate_limit_spin.value())
+        self.settings.setValue("ingest_queue_size", self.ingest_queue_spin.value())
+        try:
+            sources = self.collect_sources()
+        except ValueError as e:
+            QMessageBox.warning(self, "设置", str(e))
+            return
         self.settings.setValue("api_enabled", self.api_enabled_checkbox.isChecked())
-        self.settings.setValue("api_url", self.api_url_edit.text().strip())
-        self.settings.setValue("poll_interval", self.poll_interval_spin.value())
+        self.settings.setValue("api_sources", json.dumps(sources, ensure_ascii=False))
         self.accept()
 
-class APIPoller(QObject):
-    notification_fetched = Signal(str, str, object)
+class DaemonConnection(QObject):
+    """托盘前端到守护进程（pi_core.py）的本地套接字连接，断开后定时重连
 
-    def __init__(self, parent=None):
+    守护进程发来的每行JSON事件通过 event_received 信号交给GUI线程。
+    """
+    event_received = Signal(dict)
+    connection_changed = Signal(bool)
+    RECONNECT_INTERVAL = 2000  # 毫秒
+
+    def __init__(self, path, parent=None):
         super().__init__(parent)
-        self.settings = QSettings("PiApp", "NotificationApp")
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.poll_api)
-        self.setup_polling()
+        from PySide6.QtNetwork import QLocalSocket
+
+        self.path = path
+        self.connected = False
+        self.closing = False
+        self.buffer = b""
+        self.socket = QLocalSocket(self)
+        self.socket.connected.connect(self.on_connected)
+        self.socket.disconnected.connect(self.on_disconnected)
+        self.socket.errorOccurred.connect(self.on_error)
+        self.socket.readyRead.connect(self.on_ready_read)
+
+        self.reconnect_timer = QTimer(self)
+        self.reconnect_timer.setSingleShot(True)
+        self.reconnect_timer.setInterval(self.RECONNECT_INTERVAL)
+        self.reconnect_timer.timeout.connect(self.connect_to_daemon)
+
+    def connect_to_daemon(self):
+        self.socket.abort()
+        self.buffer = b""
+        self.socket.connectToServer(self.path)
+
+    def on_connected(self):
+        self.connected = True
+        logging.info(f"已连接到守护进程: {self.path}", extra={"event": "daemon_connected"})
+        self.connection_changed.emit(True)
+
+    def on_disconnected(self):
+        if self.connected:
+            self.connected = False
+            logging.warning("与守护进程的连接已断开", extra={"event": "daemon_disconnected"})
+            self.connection_changed.emit(False)
+        if not self.closing:
+            self.reconnect_timer.start()
+
+    def on_error(self, error):
+        # 连接失败（守护进程未启动）时不会触发 disconnected
+        if not self.connected and not self.closing:
+            self.reconnect_timer.start()
+
+    def on_ready_read(self):
+        self.buffer += bytes(self.socket.readAll())
+        *lines, self.buffer = self.buffer.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logging.warning("收到无效的守护进程事件，已忽略")
+                continue
+            self.event_received.emit(event)
+
+    def send(self, command):
+        if not self.connected:
+            logging.warning(f"未连接到守护进程，命令 {command.get('type')} 未发送")
+            return False
+        self.socket.write((json.dumps(command) + "\n").encode("utf-8"))
+        return True
+
+    def close(self):
+        self.closing = True
+        self.connected = False
+        self.reconnect_timer.stop()
+        self.socket.abort()
+
+class EmbeddedDaemon(QObject):
+    """在本进程中运行的通知核心（pi_core.NotificationDaemon），接口与 DaemonConnection 相同
+
+    核心在 connect_to_daemon 时才创建，打开通知历史和补写接收日志不会推迟托盘图标的显示。
+    核心在接收、轮询等线程中发布的事件通过 event_received 信号交给GUI线程，命令直接交给核心处理。
+    """
+    event_received = Signal(dict)
+    connection_changed = Signal(bool)
+
+    def __init__(self, settings, log, parent=None):
+        super().__init__(parent)
+        self.settings = settings
+        self.log = log
+        self.daemon = None
+        self.connected = False
 
-    def setup_polling(self):
-        if not self.settings.value("api_enabled", False, type=bool):
-            logging.info("远端API功能未启用")
+    def connect_to_daemon(self):
+        self.daemon = NotificationDaemon(self.settings, self.log)
+        try:
+            self.daemon.start_services(frontends=False)
+        except OSError as e:
+            logging.error(f"接收服务启动失败: {str(e)}")
+        self.daemon.start_polling()
+
+        # 去重记录的保存和接收日志的清理
+        self.maintain_timer = QTimer(self)
+        self.maintain_timer.timeout.connect(self.daemon.maintain)
+        self.maintain_timer.start(self.daemon.SAVE_INTERVAL * 1000)
+
+        # 快照和注册在同一把锁内完成，不会漏掉或重复收到事件
+        with self.daemon.lock:
+            self.event_received.emit(self.daemon.snapshot())
+            self.daemon.listeners.append(self.on_event)
+        self.connected = True
+        self.connection_changed.emit(True)
+
+    def on_event(self, event):
+        self.event_received.emit(event)
+
+    def reload_settings(self):
+        if self.daemon:
+            self.daemon.poller.setup_polling(self.settings)
+
+    def send(self, command):
+        if self.daemon is None:
+            logging.warning(f"通知核心尚未启动，命令 {command.get('type')} 未处理")
+            return False
+        self.daemon.handle_command(command)
+        return True
+
+    def close(self):
+        self.connected = False
+        if self.daemon is None:
             return
+        self.maintain_timer.stop()
+        with self.daemon.lock:
+            self.daemon.listeners.remove(self.on_event)
+        self.daemon.shutdown()
 
-        interval = self.settings.value("poll_interval", 300, type=int)
-        self.timer.start(interval * 1000)
-        logging.info(f"设置API轮询间隔为 {interval} 秒")
+class DaemonHistoryStore:
+    """连接守护进程时使用的通知历史，接口与 HistoryStore 相同
 
-    def update_polling_interval(self, enabled, interval):
-        self.timer.stop()
+    分页直接以只读方式查询守护进程的数据库（WAL模式下不会互相阻塞），已读标记作为命令发给守护进程；
+    未读数和总数由守护进程的事件更新。
+    """
 
-        if enabled:
-            self.timer.start(interval * 1000)
-            logging.info(f"更新API轮询间隔为 {interval} 秒")
-        else:
-            logging.info("远端API功能已禁用")
+    def __init__(self, db_path, connection):
+        self.db_path = db_path
+        self.connection = connection
+        self.unread_count = 0
+        self.total_count = 0
+        self._conn = None
 
-    def poll_api(self):
-        if not self.settings.value("api_enabled", False, type=bool):
-            return
+    def pending_count(self):
+        return 0
 
-        api_url = self.settings.value("api_url", "")
-        if not api_url:
-            logging.warning("未配置API URL，跳过轮询")
-            return
+    def recent(self, limit):
+        return self.fetch_page(None, limit)
 
-        logging.info(f"开始轮询API: {api_url}")
+    def fetch_page(self, before_id, limit):
+        import sqlite3
         try:
-            response = requests.get(api_url, timeout=10)
-            if response.status_code == 200:
-                data = response.json()
-                self.process_api_response(data)
-            else:
-                logging.warning(f"API请求失败，状态码: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"API请求错误: {str(e)}")
-        except json.JSONDecodeError:
-            logging.error("API返回的不是有效JSON数据")
-
-    def process_api_response(self, data):
-        notifications = data.get("notifications", [])
-        if not notifications:
-            logging.info("API返回无新通知")
+            if self._conn is None:
+                self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=10)
+                self._conn.row_factory = sqlite3.Row
+            return HistoryStore.query_page(self._conn, before_id, limit)
+        except sqlite3.Error as e:
+            # 守护进程还没有创建数据库等情况，下次重新打开
+            logging.warning(f"读取守护进程的通知历史失败: {str(e)}")
+            self.close()
+            return []
+
+    def mark_read(self, notification_ids):
+        if self.connection.send({"type": "mark_read", "ids": list(notification_ids)}):
+            self.unread_count = max(0, self.unread_count - len(notification_ids))
+
+    def mark_all_read(self):
+        if self.connection.send({"type": "mark_all_read"}):
+            self.unread_count = 0
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+class EmbeddedHistoryStore(DaemonHistoryStore):
+    """在本进程中运行通知核心时使用，分页直接查询核心的 HistoryStore，包含尚未提交的写入"""
+
+    def fetch_page(self, before_id, limit):
+        daemon = self.connection.daemon
+        if daemon is None:
+            return []
+        with daemon.lock:
+            return daemon.history_store.fetch_page(before_id, limit)
+
+class NotificationCoalescer(QObject):
+    """在时间窗口内合并通知的展示（弹窗、音效、托盘更新）
+
+    空闲时到达的通知立即展示并开启窗口，窗口内后续到达的通知在窗口结束时合并为一次展示。
+    窗口为0时不做合并。
+    """
+    flushed = Signal(list)
+
+    def __init__(self, window_ms, parent=None):
+        super().__init__(parent)
+        self.window_ms = window_ms
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.flush)
+
+    def set_window(self, window_ms):
+        self.window_ms = window_ms
+        if window_ms <= 0:
+            self.timer.stop()
+            self.flush()
+
+    def add(self, notifications):
+        if self.window_ms <= 0:
+            self.flushed.emit(list(notifications))
             return
 
-        logging.info(f"从API获取到 {len(notifications)} 条新通知")
-        for notification in notifications:
-            title = notification.get("title", "API通知")
-            message = notification.get("message", "收到新通知")
-            timestamp = notification.get("timestamp", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-            self.notification_fetched.emit(title, message, timestamp)
+        if self.timer.isActive():
+            self.pending.extend(notifications)
+            return
+
+        self.flushed.emit(list(notifications))
+        self.timer.start(self.window_ms)
+
+    def flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        self.flushed.emit(pending)
+        # 持续的突发流量每个窗口最多展示一次
+        if self.window_ms > 0:
+            self.timer.start(self.window_ms)
+
+class StartupProfiler:
+    """记录启动各阶段的耗时，--profile-startup 时输出到标准错误"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = [("导入模块", time.perf_counter() - _PROCESS_STARTED)]
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = sum(seconds for phase, seconds in self.phases)
+        logging.info(f"启动完成，耗时 {total * 1000:.0f} 毫秒", extra={
+            "event": "startup", "latency_ms": round(total * 1000)
+        })
+        if not self.enabled:
+            return
+        lines = []
+        elapsed = 0.0
+        for phase, seconds in self.phases:
+            elapsed += seconds
+            lines.append(f"{phase}: {seconds * 1000:.1f} ms（累计 {elapsed * 1000:.1f} ms）")
+        # 应用会把 sys.stdout/stderr 重定向到日志
+        sys.__stderr__.write("\n".join(lines) + "\n")
+        sys.__stderr__.flush()
 
 class StatusBarApp(QObject):
-    notification_received = Signal(str, str, object)
+    """托盘前端：通知的展示、历史菜单和设置
 
-    def __init__(self):
+    接收、轮询和历史写入都由通知核心完成：默认在本进程中运行（EmbeddedDaemon），
+    --attach 时连接单独运行的守护进程（DaemonConnection），两种情况下处理的是相同的事件。
+    """
+    RECENT_LIMIT = 5  # 托盘菜单中显示的最近通知数，完整历史见历史窗口
+    LAG_PROBE_INTERVAL = 500  # 毫秒，事件循环延迟探测间隔
+
+    @property
+    def unread_count(self):
+        return self.history_store.unread_count
+
+    def __init__(self, profile_startup=False, attach=False):
         super().__init__()
+        self.attach = attach  # 作为守护进程的前端运行，通知核心在另一个进程中
+        self.startup_profiler = StartupProfiler(profile_startup)
         self.app = QApplication(sys.argv)
 
         self.app.setApplicationName("NotifyPI")
@@ -538,32 +1672,34 @@ class StatusBarApp(QObject):
         self.app.setOrganizationDomain("com.dadoulab") # 与 bundle_identifier 对应
 
         self.app.setQuitOnLastWindowClosed(False)
-        self.server = None
-        self.server_thread = None
         self.notifications = []
-        self.unread_count = 0
-        self.server_running = True
-        self.popup = None
+        self.popup_manager = None
         self.log_viewer = None
+        self.history_window = None
+        # 由 finish_startup 创建；托盘菜单在此之前就可以选择退出
+        self.notification_dispatcher = None
+        self.quitting = False
+        self.sound_effect = None
+        self.startup_profiler.mark("QApplication")
+
+        # 初始化设置（日志格式也由设置决定）
+        self.settings = app_settings()
 
         # 初始化日志系统
         self.setup_logging()
+        self.startup_profiler.mark("日志")
+
+        # 通知核心：本进程中运行时在 finish_startup 中创建，前端模式下连接守护进程；
+        # 托盘菜单和历史窗口由核心的事件（首先是 snapshot）填充
+        db_path = os.path.join(APP_DIR, "history.db")
+        if self.attach:
+            self.daemon_connection = DaemonConnection(os.path.join(APP_DIR, "daemon.sock"), self)
+            self.history_store = DaemonHistoryStore(db_path, self.daemon_connection)
+        else:
+            self.daemon_connection = EmbeddedDaemon(self.settings, self.log, self)
+            self.history_store = EmbeddedHistoryStore(db_path, self.daemon_connection)
 
-        # 初始化设置
-        self.settings = QSettings("PiApp", "NotificationApp")
-        self.sound_enabled = self.settings.value("sound_enabled", True, type=bool)
-
-        # 初始化音频
-        self.sound_effect = QSoundEffect()
-        self.init_sound()
-
-        # 初始化API轮询器
-        self.api_poller = APIPoller(self)
-        self.api_poller.notification_fetched.connect(self.handle_notification)
-
-        self.notification_received.connect(self.handle_notification)
-
-        # 加载基础图标
+        # 托盘图标和菜单最先显示，其余组件在事件循环启动后由 finish_startup 初始化
         self.base_icon_black = self.load_icon("media/pi-nomal.png")
         self.base_icon_update = self.load_icon("media/pi-update.png")
         self.numbered_icons = {}
@@ -587,6 +1723,10 @@ class StatusBarApp(QObject):
         self.history_menu = QMenu("消息历史", self.menu)
         self.history_menu.setProperty("_q_menu_sloppy_behavior", False)
 
+        self.view_history_action = QAction("查看全部历史...", self.menu)
+        self.view_history_action.triggered.connect(self.show_history_window)
+        self.init_history_menu()
+
         self.mark_read_action = QAction("标记所有为已读", self.menu)
         self.mark_read_action.triggered.connect(self.mark_all_as_read)
 
@@ -610,43 +1750,79 @@ class StatusBarApp(QObject):
         self.tray_icon.setContextMenu(self.menu)
         self.tray_icon.activated.connect(self.on_tray_icon_activated)
         self.tray_icon.show()
-
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
-
-        self.start_server_thread()
         self.update_history_menu()
+        self.startup_profiler.mark("托盘图标")
 
-        QToolTip.setFont(QFont("PingFang SC", 10))
-        QToolTip.setPalette(QPalette(QColor(240, 240, 240), QColor(80, 80, 80)))
+        QTimer.singleShot(0, self.finish_startup)
 
-        # 立即执行一次API轮询
-        QTimer.singleShot(5000, self.api_poller.poll_api)
+    def finish_startup(self):
+        """托盘图标显示后再初始化的部分：通知核心、弹窗、系统通知和音效"""
+        if self.quitting:
+            return
+        self.startup_profiler.mark("事件循环启动")
 
-    def setup_logging(self):
-        log_dir = os.path.expanduser("~/.pi_notification")
-        if not os.path.exists(log_dir):
-            os.makedirs(log_dir)
+        # 本进程中的事件来自接收和轮询线程，一律排队处理，与GUI线程自身发出的事件保持先后顺序
+        self.daemon_connection.event_received.connect(self.handle_daemon_event, Qt.QueuedConnection)
+        self.daemon_connection.connection_changed.connect(self.on_daemon_connection_changed)
+        self.daemon_connection.connect_to_daemon()
 
-        log_file = os.path.join(log_dir, "app.log")
+        # 运行指标：本进程中运行通知核心时与接收服务共用，通过 GET /metrics 和 /stats 读取
+        self.metrics = Metrics() if self.attach else self.daemon_connection.daemon.metrics
+        self.startup_profiler.mark("通知核心")
 
-        formatter = logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
+        self.sound_enabled = self.settings.value("sound_enabled", True, type=bool)
 
-        file_handler = RotatingFileHandler(
-            log_file, maxBytes=1024*1024, backupCount=5
+        # 突发通知合并
+        self.coalescer = NotificationCoalescer(
+            self.settings.value("coalesce_window", 1000, type=int), self
         )
-        file_handler.setFormatter(formatter)
+        self.coalescer.flushed.connect(self.display_notifications)
 
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
+        # 预先创建弹窗，通知到达时直接复用
+        self.popup_manager = PopupManager(self.settings.value("max_popups", 3, type=int), self)
 
-        self.logger = logging.getLogger()
-        self.logger.setLevel(logging.INFO)
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        # 系统通知在后台线程发送，不阻塞事件循环
+        self.notification_dispatcher = NotificationDispatcher(create_notification_backend(
+            self.settings.value("native_backend", "auto"), self.tray_icon
+        ))
+        self.startup_profiler.mark("弹窗和系统通知")
+
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+
+        # 定时器实际触发时间与预期的差值即为事件循环被阻塞的时间
+        self.metrics.collectors.append(self.collect_metrics)
+        self.lag_probe_last = time.monotonic()
+        self.lag_probe_timer = QTimer(self)
+        self.lag_probe_timer.setTimerType(Qt.PreciseTimer)
+        self.lag_probe_timer.timeout.connect(self.probe_event_loop_lag)
+        self.lag_probe_timer.start(self.LAG_PROBE_INTERVAL)
+
+        QToolTip.setFont(QFont("PingFang SC", 10))
+        QToolTip.setPalette(QPalette(QColor(240, 240, 240), QColor(80, 80, 80)))
+
+        # 导入 QtMultimedia 较慢，放在最后
+        self.init_sound()
+        self.startup_profiler.mark("音效")
+        self.startup_profiler.report()
+
+    def probe_event_loop_lag(self):
+        now = time.monotonic()
+        lag = now - self.lag_probe_last - self.LAG_PROBE_INTERVAL / 1000
+        self.lag_probe_last = now
+        self.metrics.observe("event_loop_lag_seconds", max(lag, 0.0))
+
+    def collect_metrics(self, metrics):
+        """读取指标时采集展示部分的队列长度等瞬时值，在接收服务线程中调用"""
+        metrics.set("queue_depth", self.notification_dispatcher.queue.qsize(), queue="native_notifications")
+        metrics.set("queue_depth", len(self.coalescer.pending), queue="coalescer")
+        metrics.set("native_dropped", self.notification_dispatcher.dropped)
+        metrics.set("native_rate_limited", self.notification_dispatcher.rate_limited)
+
+    def setup_logging(self):
+        # 文件和控制台写入由后台线程完成，调用方只做入队
+        self.log = QueuedLogging(self.settings, "app.log")
+        self.logger = self.log.logger
 
         sys.stdout = self.LoggerWriter(self.logger.info)
         sys.stderr = self.LoggerWriter(self.logger.error)
@@ -663,7 +1839,7 @@ class StatusBarApp(QObject):
             pass
 
     def show_log_viewer(self):
-        log_file = os.path.expanduser("~/.pi_notification/app.log")
+        log_file = os.path.join(APP_DIR, "app.log")
 
         if not os.path.exists(log_file):
             try:
@@ -687,6 +1863,20 @@ class StatusBarApp(QObject):
     def on_log_viewer_closed(self):
         self.log_viewer = None
 
+    def show_history_window(self):
+        if self.history_window is None:
+            self.history_window = HistoryWindow(self.history_store)
+            self.history_window.notification_activated.connect(self.show_notification_detail)
+            self.history_window.mark_all_requested.connect(self.mark_all_as_read)
+            self.history_window.finished.connect(self.on_history_window_closed)
+
+        self.history_window.show()
+        self.history_window.activateWindow()
+        self.history_window.raise_()
+
+    def on_history_window_closed(self):
+        self.history_window = None
+
     def load_icon(self, filename):
         icon_path = os.path.join(os.path.dirname(__file__), filename)
         if os.path.exists(icon_path):
@@ -695,6 +1885,14 @@ class StatusBarApp(QObject):
         return QIcon.fromTheme("dialog-information")
 
     def init_sound(self):
+        try:
+            from PySide6.QtMultimedia import QSoundEffect
+        except ImportError as e:
+            # 部分 PySide6 发行版不带 QtMultimedia，或缺少它依赖的系统音频库
+            logging.warning(f"无法加载 QtMultimedia，音效功能将不可用: {str(e)}")
+            return
+
+        self.sound_effect = QSoundEffect()
         sound_file = self.find_sound_file()
         if sound_file:
             self.sound_effect.setSource(QUrl.fromLocalFile(sound_file))
@@ -721,17 +1919,22 @@ class StatusBarApp(QObject):
         return None
 
     def play_notification_sound(self):
-        if self.sound_enabled and self.sound_effect.source().isValid():
-            logging.info("播放通知音效...")
+        if self.sound_enabled and self.sound_effect and self.sound_effect.source().isValid():
+            logging.info("播放通知音效...", extra={"event": "sound_played"})
             self.sound_effect.play()
 
     def show_settings(self):
         dialog = SettingsDialog()
         if dialog.exec() == QDialog.Accepted:
             self.sound_enabled = self.settings.value("sound_enabled", True, type=bool)
-            api_enabled = self.settings.value("api_enabled", False, type=bool)
-            poll_interval = self.settings.value("poll_interval", 300, type=int)
-            self.api_poller.update_polling_interval(api_enabled, poll_interval)
+            self.coalescer.set_window(self.settings.value("coalesce_window", 1000, type=int))
+            self.popup_manager.set_max_visible(self.settings.value("max_popups", 3, type=int))
+            self.notification_dispatcher.set_backend(create_notification_backend(
+                self.settings.value("native_backend", "auto"), self.tray_icon
+            ))
+            if not self.attach:
+                self.daemon_connection.reload_settings()
+            self.log.apply_format()
 
     def show_about_dialog(self):
         """显示关于对话框"""
@@ -781,117 +1984,225 @@ class StatusBarApp(QObject):
         self.numbered_icons[count] = QIcon(new_pixmap)
         return self.numbered_icons[count]
 
+    def update_tooltip(self, poller_status):
+        tooltip = "Pi - 消息通知"
+        if poller_status:
+            tooltip += "\n" + poller_status
+        self.tray_icon.setToolTip(tooltip)
+
     def update_icon_state(self):
         icon = self.create_numbered_icon(self.unread_count)
         self.tray_icon.setIcon(icon)
 
     def mark_all_as_read(self):
+        self.history_store.mark_all_read()
+        self.show_all_read()
+
+    def show_all_read(self):
         for notification in self.notifications:
             notification["read"] = True
-        self.unread_count = 0
+        self.menu_all_read = True
+        if self.history_window:
+            self.history_window.model.mark_all_read()
+            self.history_window.update_count()
+        self.update_icon_state()
+        self.update_history_menu()
+
+    def mark_as_read(self, notification_id):
+        """标记单条通知为已读，同步托盘菜单和历史窗口"""
+        self.history_store.mark_read([notification_id])
+        self.show_read([notification_id])
+
+    def show_read(self, notification_ids):
+        notification_ids = set(notification_ids)
+        self.menu_read_ids |= notification_ids
+        for notification in self.notifications:
+            if notification["id"] in notification_ids:
+                notification["read"] = True
+        if self.history_window:
+            for notification_id in notification_ids:
+                self.history_window.model.mark_read(notification_id)
+            self.history_window.update_count()
         self.update_icon_state()
         self.update_history_menu()
 
+    def on_daemon_connection_changed(self, connected):
+        if not connected:
+            self.update_tooltip("未连接到守护进程")
+
+    def handle_daemon_event(self, event):
+        """处理通知核心推送的事件，连接（或重连）后先收到 snapshot"""
+        kind = event.get("type")
+        if "unread" in event:
+            self.history_store.unread_count = event["unread"]
+        if "total" in event:
+            self.history_store.total_count = event["total"]
+
+        if kind == "notifications":
+            self.ingest_records(event["items"])
+        elif kind == "read":
+            self.show_read(event["ids"])
+        elif kind == "read_all":
+            self.show_all_read()
+        elif kind == "status":
+            self.update_tooltip(event["text"])
+        elif kind == "snapshot":
+            # 断开期间错过的通知只补进菜单和历史窗口，不再弹窗
+            newest_id = self.notifications[-1]["id"] if self.notifications else 0
+            missed = [n for n in reversed(event["notifications"]) if n["id"] > newest_id]
+            self.notifications.extend(missed)
+            del self.notifications[:-self.RECENT_LIMIT]
+            if self.history_window:
+                model = self.history_window.model
+                top_id = model.rows[0]["id"] if model.rows else 0
+                model.prepend([n for n in missed if n["id"] > top_id])
+            self.update_tooltip(event.get("status", ""))
+            self.show_read([n["id"] for n in event["notifications"] if n["read"]])
+
     def on_tray_icon_activated(self, reason):
         if reason == QSystemTrayIcon.Context:
             tray_geometry = self.tray_icon.geometry()
             position = tray_geometry.center()
             self.menu.popup(position)
 
-    def start_server_thread(self):
-        self.server_thread = threading.Thread(target=self.start_server)
-        self.server_thread.daemon = True
-        self.server_thread.start()
-
-    def start_server(self):
-        server_address = ('', 8000)
-        self.server = ThreadingHTTPServer(server_address, NotificationHandler)
-        self.server.status_bar_app = self
-        logging.info(f"服务器运行在端口 {server_address[1]}")
-
-        try:
-            while self.server_running:
-                self.server.handle_request()
-        except OSError:
-            pass
-
     def signal_handler(self, signum, frame):
         logging.info("收到终止信号，正在关闭...")
         self.quit()
 
-    def handle_notification(self, title, message, timestamp):
-        self.notifications.append({
-            "title": title,
-            "message": message,
-            "timestamp": timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "read": False
-        })
-        self.unread_count += 1
+    def ingest_records(self, records):
+        """通知核心已写入历史的通知：更新菜单列表和历史窗口，交给合并器展示"""
+        self.notifications.extend(records)
+        del self.notifications[:-self.RECENT_LIMIT]
+
+        if self.history_window:
+            self.history_window.model.prepend(records)
+            self.history_window.update_count()
 
-        if len(self.notifications) > 20:
-            removed = self.notifications.pop(0)
-            if not removed["read"]:
-                self.unread_count -= 1
+        self.coalescer.add(records)
 
+    def display_notifications(self, notifications):
+        """展示一组（可能已合并的）通知：一次托盘更新、一次音效、一个弹窗"""
         self.update_history_menu()
         self.update_icon_state()
 
         self.play_notification_sound()
 
-        if platform.system() == "Darwin":
-            subprocess.run(['osascript', '-e',
-                           f'display notification "{message}" with title "{title}"'])
+        if len(notifications) == 1:
+            title = notifications[0]["title"]
+            message = notifications[0]["message"]
         else:
-            self.tray_icon.showMessage(title, message, QSystemTrayIcon.Information, 5000)
-        self.show_popup(title, message)
+            latest = notifications[-1]
+            title = f"收到 {len(notifications)} 条新通知"
+            message = f"{latest['title']}: {latest['message']}"
+
+        self.show_native_notification(title, message)
+        self.show_popup(title, message, len(notifications))
+
+        now = time.monotonic()
+        for notification in notifications:
+            if notification.get("received_at"):
+                self.metrics.observe("display_latency_seconds", now - notification["received_at"])
+        if len(notifications) > 1:
+            self.metrics.inc("coalesced", len(notifications) - 1)
+
+    def show_native_notification(self, title, message):
+        self.notification_dispatcher.dispatch(title, message)
+
+    def init_history_menu(self):
+        """创建历史菜单的固定结构，通知条目之后由 _update_history_menu 增量维护"""
+        self.history_actions = OrderedDict()  # id -> QAction，按从旧到新排列
+        self.menu_read_ids = set()
+        self.menu_all_read = False
+        self.menu_update_scheduled = False
+
+        self.bold_font = QFont(self.history_menu.font())
+        self.bold_font.setBold(True)
+
+        self.history_count_action = QAction("消息数量: 0", self.history_menu)
+        self.history_count_action.setEnabled(False)
+        self.history_menu.addAction(self.history_count_action)
+        self.history_menu.addSeparator()
+
+        self.history_empty_action = QAction("暂无消息", self.history_menu)
+        self.history_empty_action.setEnabled(False)
+        self.history_menu.addAction(self.history_empty_action)
+
+        self.history_bottom_separator = self.history_menu.addSeparator()
+        self.history_menu.addAction(self.view_history_action)
 
     def update_history_menu(self):
-        QTimer.singleShot(0, self._update_history_menu)
+        """同一轮事件循环内的多次更新请求只会触发一次菜单维护"""
+        if not self.menu_update_scheduled:
+            self.menu_update_scheduled = True
+            QTimer.singleShot(0, self._update_history_menu)
 
     def _update_history_menu(self):
+        self.menu_update_scheduled = False
         self.history_menu.blockSignals(True)
-        self.history_menu.clear()
-
-        if not self.notifications:
-            action = QAction("消息数量: 0", self.history_menu)
-            action.setEnabled(False)
-            self.history_menu.addAction(action)
-            self.history_menu.addSeparator()
-            action = QAction("暂无消息", self.history_menu)
-            action.setEnabled(False)
-            self.history_menu.addAction(action)
+
+        # 新通知插入顶部：self.notifications 从旧到新排列，只需查看尾部新增部分
+        newest_id = next(reversed(self.history_actions), 0)
+        new_notifications = []
+        for notification in reversed(self.notifications):
+            if notification["id"] <= newest_id:
+                break
+            new_notifications.append(notification)
+
+        for notification in reversed(new_notifications):
+            before = self.history_actions[next(reversed(self.history_actions))] \
+                if self.history_actions else self.history_bottom_separator
+            action = self._create_history_action(notification)
+            self.history_menu.insertAction(before, action)
+            self.history_actions[notification["id"]] = action
+
+        # 淘汰最旧的条目
+        while len(self.history_actions) > self.RECENT_LIMIT:
+            _, action = self.history_actions.popitem(last=False)
+            self.history_menu.removeAction(action)
+            action.deleteLater()
+
+        # 只更新已读状态发生变化的条目
+        if self.menu_all_read:
+            changed_ids = list(self.history_actions)
         else:
-            count_text = f"消息数量: {len(self.notifications)}"
-            if self.unread_count > 0:
-                count_text += f" (未读: {self.unread_count})"
-            count_action = QAction(count_text, self.history_menu)
-            count_action.setEnabled(False)
-            self.history_menu.addAction(count_action)
-            self.history_menu.addSeparator()
-
-            for notification in reversed(self.notifications):
-                title = notification["title"]
-                msg = notification["message"][:20] + ("..." if len(notification["message"]) > 20 else "")
-                timestamp = notification["timestamp"]
-                read_status = "" if notification["read"] else " [未读]"
-                display_text = f"{title}: {msg}{read_status}"
-                if timestamp:
-                    display_text += f" [{timestamp}]"
-
-                action = QAction(display_text, self.history_menu)
-                action.setData(notification)
-                action.triggered.connect(partial(self.show_notification_detail, notification))
-                action.hovered.connect(self.on_action_hovered)
-
-                if not notification["read"]:
-                    font = action.font()
-                    font.setBold(True)
-                    action.setFont(font)
-
-                self.history_menu.addAction(action)
+            changed_ids = [i for i in self.menu_read_ids if i in self.history_actions]
+        for notification_id in changed_ids:
+            action = self.history_actions[notification_id]
+            notification = action.data()
+            if notification and not notification["read"]:
+                notification["read"] = True
+                self._apply_history_action_state(action, notification)
+        self.menu_read_ids.clear()
+        self.menu_all_read = False
+
+        count_text = f"消息数量: {self.history_store.total_count}"
+        if self.unread_count > 0:
+            count_text += f" (未读: {self.unread_count})"
+        self.history_count_action.setText(count_text)
+        self.history_empty_action.setVisible(not self.history_actions)
 
         self.history_menu.blockSignals(False)
 
+    def _create_history_action(self, notification):
+        action = QAction(self.history_menu)
+        action.triggered.connect(partial(self.show_notification_detail, notification))
+        action.hovered.connect(self.on_action_hovered)
+        self._apply_history_action_state(action, dict(notification))
+        return action
+
+    def _apply_history_action_state(self, action, notification):
+        title = notification["title"]
+        msg = notification["message"][:20] + ("..." if len(notification["message"]) > 20 else "")
+        timestamp = notification["timestamp"]
+        read_status = "" if notification["read"] else " [未读]"
+        display_text = f"{title}: {msg}{read_status}"
+        if timestamp:
+            display_text += f" [{timestamp}]"
+
+        action.setText(display_text)
+        action.setData(notification)
+        action.setFont(self.history_menu.font() if notification["read"] else self.bold_font)
+
     def on_action_hovered(self):
         action = self.sender()
         if not action or not action.data():
@@ -911,10 +2222,7 @@ class StatusBarApp(QObject):
 
     def show_notification_detail(self, notification):
         if not notification["read"]:
-            notification["read"] = True
-            self.unread_count -= 1
-            self.update_icon_state()
-            self.update_history_menu()
+            self.mark_as_read(notification["id"])
 
         msg_box = QMessageBox()
         msg_box.setWindowTitle(notification["title"])
@@ -925,30 +2233,33 @@ class StatusBarApp(QObject):
         msg_box.setIcon(QMessageBox.Information)
         msg_box.exec()
 
-    def show_popup(self, title, message):
-        QTimer.singleShot(0, lambda: self._show_popup(title, message))
+    def show_popup(self, title, message, count=1):
+        QTimer.singleShot(0, lambda: self._show_popup(title, message, count))
 
-    def _show_popup(self, title, message):
-        if self.popup and self.popup.isVisible():
-            self.popup.close()
-        self.popup = NotificationPopup(title, message)
+    def _show_popup(self, title, message, count):
         tray_pos = self.tray_icon.geometry().center()
-        self.popup.show_at_position(tray_pos)
+        self.popup_manager.show(title, message, tray_pos, count)
 
     def quit(self):
-        if self.server_running:
-            self.server_running = False
-            self.server.socket.close()
-        if self.server_thread and self.server_thread.is_alive():
-            self.server_thread.join(1)
-        if self.popup:
-            self.popup.close()
+        self.quitting = True
+        if self.popup_manager:
+            self.popup_manager.close_all()
         if self.log_viewer:
             self.log_viewer.close()
+        if self.history_window:
+            self.history_window.close()
+        if self.notification_dispatcher:
+            self.notification_dispatcher.stop()
+        self.daemon_connection.close()
+        self.history_store.close()
         self.tray_icon.hide()
         self.app.quit()
-        logging.info("应用程序已关闭")
+        logging.info("应用程序已关闭", extra={"event": "app_stopped"})
+        self.log.stop()
 
 if __name__ == "__main__":
-    app = StatusBarApp()
+    app = StatusBarApp(
+        profile_startup="--profile-startup" in sys.argv,
+        attach="--attach" in sys.argv
+    )
     sys.exit(app.app.exec())
@@ -0,0 +1,2479 @@
+"""NotifyPI 核心：通知接收、远端轮询、通知历史和运行指标
+
+本模块不依赖Qt。托盘应用 pi_app.py 在进程内运行 NotificationDaemon，自身只负责展示；
+也可以作为守护进程单独运行，托盘前端通过本地套接字连接守护进程（pi_app.py --attach）：
+
+    python pi_core.py [--config ~/.pi_notification/daemon.json]
+"""
+import sys
+import json
+import threading
+import signal
+import socket
+import os
+import logging
+import itertools
+import bisect
+import random
+import hashlib
+import queue
+import time
+import argparse
+import socketserver
+import math
+import struct
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime
+from collections import OrderedDict
+
+# 设置 NOTIFYPI_HOME 时数据和设置都放在该目录下，便于隔离运行（如基准测试）
+APP_DIR = os.environ.get("NOTIFYPI_HOME") or os.path.expanduser("~/.pi_notification")
+
+def _scalar_field(data, name, default):
+    """字段缺失或为 null 时返回 default，数字、布尔值转为字符串，对象和数组抛出 ValueError"""
+    value = data.get(name)
+    if value is None:
+        return default
+    if isinstance(value, (dict, list)):
+        raise ValueError(f"{name} 字段必须是字符串")
+    return value if isinstance(value, str) else str(value)
+
+def normalize_notification(data):
+    """将单条JSON对象规范化为通知字典，title、message、timestamp 和 id 都规范为字符串（timestamp、id 可以没有）"""
+    if not isinstance(data, dict):
+        raise ValueError("通知必须是JSON对象")
+    notification = {
+        "title": _scalar_field(data, 'title', '通知'),
+        "message": _scalar_field(data, 'message', '这是一条通知消息'),
+        "timestamp": _scalar_field(data, 'timestamp', None)
+    }
+    notification_id = _scalar_field(data, 'id', None)
+    if notification_id is not None:
+        notification["id"] = notification_id
+    return notification
+
+def _safe_normalize(data):
+    try:
+        return normalize_notification(data)
+    except Exception as e:
+        return e
+
+def parse_notification_payload(body, content_type=""):
+    """解析POST请求体，返回 (是否为批量, 条目列表)
+
+    支持单个JSON对象、JSON数组以及NDJSON（每行一个JSON对象）。
+    批量模式下解析失败的条目以异常对象的形式保留在列表中，便于逐条返回状态。
+    """
+    if "ndjson" not in content_type:
+        try:
+            data = json.loads(body)
+        except json.JSONDecodeError as e:
+            # 多个JSON对象按行拼接时按NDJSON处理
+            if e.msg != "Extra data":
+                raise
+        else:
+            if isinstance(data, list):
+                return True, [_safe_normalize(item) for item in data]
+            return False, [normalize_notification(data)]
+
+    entries = []
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(normalize_notification(json.loads(line)))
+        except Exception as e:
+            entries.append(e)
+    return True, entries
+
+MAX_BODY_SIZE = 1024 * 1024  # 默认的请求体（本地套接字为单行）大小上限，字节
+
+class IngestRejected(Exception):
+    """通知因超过限速（429）、接收队列已满或写入接收日志失败（503）被拒绝，retry_after 为建议的重试间隔（秒）"""
+
+    def __init__(self, status, retry_after, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason or ("rate_limited" if status == 429 else "queue_full")
+
+class IngestLimiter:
+    """按客户端限速的令牌桶，rate 为每秒允许的通知数（0 表示不限速），突发量为 BURST_SECONDS 秒的配额
+
+    只保留最近活跃的 MAX_CLIENTS 个客户端的令牌桶。
+    """
+    BURST_SECONDS = 5
+    MAX_CLIENTS = 1024
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(1, rate * self.BURST_SECONDS)
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, client, count):
+        """客户端的配额不足 count 条时抛出 IngestRejected"""
+        if self.rate <= 0 or client is None:
+            return
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.capacity)
+                if len(self._buckets) > self.MAX_CLIENTS:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+        # 超过突发量的大批量需要等令牌桶装满
+        amount = min(count, self.capacity)
+        if not bucket.consume(amount):
+            raise IngestRejected(
+                429, bucket.retry_after(amount), f"超过限速（每秒 {self.rate} 条），请稍后重试"
+            )
+
+class IngestQueue:
+    """接收线程与写入历史的处理方之间的有界通知队列
+
+    put 可在任意线程调用，队列由空变为非空时调用一次 on_ready，处理方收到后用 drain 取走全部通知，
+    短时间内多个请求的通知会合成一批处理。待处理的通知超过 capacity 条时拒绝（503）。
+    """
+
+    def __init__(self, capacity, on_ready):
+        self.capacity = capacity
+        self.on_ready = on_ready
+        self._items = []
+        self._reserved = []  # 已写入接收日志、还在等待落盘的通知，按日志顺序排列
+        self._reserved_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items) + self._reserved_count
+
+    def put(self, notifications, deduper=None, journal=None):
+        """加入一批通知，返回与输入一一对应的布尔列表（False 表示重复）
+
+        容量检查和去重在同一把锁内完成，被拒绝的通知不会记入去重记录，客户端重试时不会被当作重复。
+        给出 journal 时，新通知在锁内写入接收日志以保持与队列相同的顺序，落盘后才对处理方可见；
+        写入失败时撤销这批通知的去重记录并抛出 IngestRejected。
+        """
+        with self._lock:
+            queued = len(self._items) + self._reserved_count
+            if queued and queued + len(notifications) > self.capacity:
+                raise IngestRejected(503, 1, "接收队列已满，请稍后重试")
+            flags = deduper.filter(notifications) if deduper else [True] * len(notifications)
+            fresh = [n for n, is_fresh in zip(notifications, flags) if is_fresh]
+            if journal and fresh:
+                fresh, batch = journal.write(fresh)
+                reservation = {"items": fresh, "state": None}
+                self._reserved.append(reservation)
+                self._reserved_count += len(fresh)
+                became_ready = False
+            else:
+                was_empty = not self._items
+                self._items.extend(fresh)
+                became_ready = was_empty and bool(self._items)
+        if became_ready:
+            self.on_ready()
+        if not (journal and fresh):
+            return flags
+
+        try:
+            journal.wait(batch)
+            error = None
+        except IngestRejected as e:
+            error = e
+        with self._lock:
+            reservation["state"] = "failed" if error else "durable"
+            if error and deduper:
+                deduper.forget(fresh)
+            # 前面的通知还没落盘时先不放出，保持与接收日志相同的顺序
+            was_empty = not self._items
+            while self._reserved and self._reserved[0]["state"]:
+                done = self._reserved.pop(0)
+                self._reserved_count -= len(done["items"])
+                if done["state"] == "durable":
+                    self._items.extend(done["items"])
+            became_ready = was_empty and bool(self._items)
+        if became_ready:
+            self.on_ready()
+        if error:
+            raise error
+        return flags
+
+    def drain(self):
+        with self._lock:
+            items, self._items = self._items, []
+        return items
+
+class IngestJournal:
+    """只追加的接收日志：通知在确认给客户端之前先写入日志并落盘
+
+    write 可在任意线程调用，只把通知放进当前批次；后台线程把这期间所有调用方的通知一次写入并 fsync，
+    调用方用 wait 等到自己的批次落盘，负载越高每次 fsync 覆盖的通知越多。
+    每条通知分配递增的序号，历史库提交时记下已写入的最大序号（检查点）；启动时检查点之后的通知
+    即为崩溃前已确认但未写入历史的通知，由 replay_into 补写。compact 丢弃检查点之前的记录。
+    某一批写入失败时只拒绝这一批，日志截断回上次落盘的位置后重新打开，之后的写入照常进行。
+    """
+
+    def __init__(self, path, checkpoint=0):
+        self.path = path
+        self.unapplied = []
+        last_seq = checkpoint
+        valid_end = 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # 崩溃时最后一行可能只写了一半，它对应的通知还没有确认给客户端
+                        break
+                    valid_end += len(line)
+                    try:
+                        entry = json.loads(line)
+                        seq, notification = int(entry["seq"]), entry["notification"]
+                    except (ValueError, TypeError, KeyError):
+                        logging.warning(f"接收日志中有无效的记录，已忽略: {path}")
+                        continue
+                    last_seq = max(last_seq, seq)
+                    if seq <= checkpoint:
+                        continue
+                    if not isinstance(notification, dict):
+                        logging.error(f"接收日志中的通知无效，已跳过: {notification!r}")
+                        continue
+                    self.unapplied.append(dict(notification, journal_seq=seq))
+        except FileNotFoundError:
+            pass
+        self._next_seq = last_seq + 1
+        self._loaded_seq = last_seq  # 启动时日志中的最大序号，重放后检查点推进到这里
+        self._written_seq = last_seq
+        self._synced_size = valid_end  # 最后一次成功 fsync 时的文件长度
+        self._batch = self._new_batch()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._synced = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()
+        self._fd = -1
+        self._reopen()
+        self._writer = threading.Thread(target=self._write_loop, name="IngestJournal", daemon=True)
+        self._writer.start()
+
+    @staticmethod
+    def _new_batch():
+        return {"lines": [], "done": False, "error": None}
+
+    def _reopen(self):
+        """打开日志文件并截断到上次落盘的位置，丢掉写了一半的记录"""
+        if self._fd >= 0:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = -1
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size > self._synced_size:
+                os.ftruncate(fd, self._synced_size)
+                os.fsync(fd)
+        except OSError:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def replay_into(self, history_store):
+        """把上次退出前已确认、但还没写入历史的通知补写进历史，返回补写的条数
+
+        记录与接收时一样经过 normalize_notification 校验，无效的记录跳过，检查点照样越过它们，
+        单条损坏的记录不会让每次启动都卡在同一处。
+        """
+        if self._loaded_seq <= history_store.journal_seq:
+            return 0
+        notifications = []
+        for entry in self.unapplied:
+            try:
+                notification = normalize_notification(entry)
+            except ValueError as e:
+                logging.error(f"接收日志中的通知无效，已跳过: {str(e)}: {entry}")
+                continue
+            notification["journal_seq"] = entry["journal_seq"]
+            notifications.append(notification)
+        if notifications:
+            history_store.add(make_history_records(notifications))
+        history_store.advance_journal_seq(self._loaded_seq)
+        logging.warning(f"从接收日志恢复了 {len(notifications)} 条通知", extra={
+            "event": "journal_replayed", "count": len(notifications)
+        })
+        self.unapplied = []
+        return len(notifications)
+
+    def write(self, notifications):
+        """为通知分配序号并放入当前批次，返回 (带 journal_seq 字段的副本, 批次)，批次交给 wait"""
+        entries = []
+        with self._lock:
+            batch = self._batch
+            for notification in notifications:
+                seq = self._next_seq
+                self._next_seq += 1
+                record = {k: v for k, v in notification.items() if k not in ("received_at", "journal_seq")}
+                batch["lines"].append(json.dumps({"seq": seq, "notification": record}, ensure_ascii=False))
+                entries.append(dict(notification, journal_seq=seq))
+            self._wakeup.notify()
+        return entries, batch
+
+    def wait(self, batch):
+        """等待批次落盘，写入失败时抛出 IngestRejected"""
+        with self._lock:
+            while not batch["done"]:
+                self._synced.wait()
+        if batch["error"] is not None:
+            raise IngestRejected(503, 1, f"写入接收日志失败: {batch['error']}", reason="journal_error")
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._batch["lines"] and not self._closed:
+                    self._wakeup.wait()
+                if not self._batch["lines"]:
+                    return
+                batch, self._batch = self._batch, self._new_batch()
+                seq = self._next_seq - 1
+            data = "".join(line + "\n" for line in batch["lines"]).encode("utf-8")
+            error = None
+            with self._io_lock:
+                try:
+                    if self._fd < 0:
+                        self._reopen()
+                    view = memoryview(data)
+                    while view:
+                        view = view[os.write(self._fd, view):]
+                    os.fsync(self._fd)
+                    self._synced_size += len(data)
+                except OSError as e:
+                    error = e
+                    # fsync 失败后无法确定这一批写入了多少，下一批写入前截断回上次落盘的位置
+                    try:
+                        self._reopen()
+                    except OSError:
+                        self._fd = -1
+            with self._lock:
+                if error is None:
+                    self._written_seq = seq
+                else:
+                    logging.error(f"写入接收日志失败: {str(error)}")
+                batch["done"] = True
+                batch["error"] = error
+                self._synced.notify_all()
+
+    def compact(self, checkpoint):
+        """丢弃序号不超过 checkpoint 的记录，checkpoint 必须已经持久地写入历史库（为 None 时不清理）"""
+        if checkpoint is None:
+            return
+        with self._io_lock:
+            if self._fd < 0 or self._synced_size == 0:
+                return
+            with self._lock:
+                written_seq = self._written_seq
+            try:
+                if checkpoint >= written_seq:
+                    os.ftruncate(self._fd, 0)
+                    self._synced_size = 0
+                    os.fsync(self._fd)
+                    return
+                # 仍有尚未写入历史的记录时，保留它们并原子地替换日志文件
+                with open(self.path, "rb") as f:
+                    keep = b"".join(line for line in f if self._entry_seq(line) > checkpoint)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(keep)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self._synced_size = len(keep)
+                self._reopen()
+            except OSError as e:
+                logging.error(f"清理接收日志失败: {str(e)}")
+
+    @staticmethod
+    def _entry_seq(line):
+        try:
+            return json.loads(line)["seq"]
+        except (ValueError, TypeError, KeyError):
+            return 0
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._writer.join()
+        with self._io_lock:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+
+def error_response(message, **fields):
+    return json.dumps(dict({"status": "error", "message": message}, **fields))
+
+def handle_notification_post(daemon, body, content_type="", transport="http", client=None):
+    """处理一次通知POST请求体，返回 (状态码, 额外响应头, JSON响应文本)
+
+    线程版、asyncio版和本地套接字接收服务共用这一处理流程。transport 用于运行指标的分类，
+    client 标识发送方，用于按客户端限速。
+    """
+    try:
+        is_batch, entries = parse_notification_payload(body.decode('utf-8'), content_type)
+        if is_batch:
+            return 200, {}, _handle_batch(daemon, entries, transport, client)
+
+        notification = entries[0]
+        if not daemon.submit_notifications([notification], transport, client)[0]:
+            return 200, {}, json.dumps({
+                "status": "success",
+                "message": "重复通知，已忽略",
+                "duplicate": True,
+                "data": notification
+            })
+        return 200, {}, json.dumps({
+            "status": "success",
+            "message": "通知已发送",
+            "data": notification
+        })
+    except IngestRejected as e:
+        daemon.metrics.inc("rejected", transport=transport, reason=e.reason)
+        return e.status, {"Retry-After": str(e.retry_after)}, error_response(
+            str(e), retry_after=e.retry_after
+        )
+    except Exception as e:
+        return 200, {}, error_response(
+            str(e), details="请确保发送的是有效的JSON格式，包含title和message字段"
+        )
+
+def _handle_batch(daemon, entries, transport, client):
+    """批量通知作为一个整体提交，并逐条返回处理状态"""
+    accepted = [entry for entry in entries if not isinstance(entry, Exception)]
+    fresh_flags = iter(daemon.submit_notifications(accepted, transport, client) if accepted else [])
+
+    results = []
+    duplicates = 0
+    for index, entry in enumerate(entries):
+        if isinstance(entry, Exception):
+            results.append({"index": index, "status": "error", "message": str(entry)})
+        elif next(fresh_flags):
+            results.append({"index": index, "status": "success", "data": entry})
+        else:
+            duplicates += 1
+            results.append({"index": index, "status": "duplicate", "data": entry})
+
+    if len(accepted) == len(entries):
+        status = "success"
+    elif accepted:
+        status = "partial"
+    else:
+        status = "error"
+
+    message = f"已接收 {len(accepted)}/{len(entries)} 条通知"
+    if duplicates:
+        message += f"，其中 {duplicates} 条重复已忽略"
+    return json.dumps({
+        "status": status,
+        "message": message,
+        "results": results
+    })
+
+def handle_metrics_get(daemon, path):
+    """处理 GET /metrics（Prometheus 文本格式）和 GET /stats（JSON），返回 (状态码, Content-Type, 响应体)"""
+    path = path.split("?", 1)[0]
+    if path == "/metrics":
+        body = daemon.metrics.render_prometheus()
+        return 200, "text/plain; version=0.0.4; charset=utf-8", body.encode('utf-8')
+    if path == "/stats":
+        body = json.dumps(daemon.metrics.snapshot(), ensure_ascii=False)
+        return 200, "application/json", body.encode('utf-8')
+    return 404, "text/plain", b"Not Found"
+
+class NotificationHandler(BaseHTTPRequestHandler):
+    def _set_response(self, status=200, content_type="text/plain", headers=None):
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_POST(self):
+        # 请求体大小先于读取检查，不信任客户端声明的长度
+        content_length = self.headers['Content-Length']
+        if content_length is None:
+            return self._send_error(411, "缺少 Content-Length")
+        try:
+            content_length = int(content_length)
+            if content_length < 0:
+                raise ValueError
+        except ValueError:
+            return self._send_error(400, "Content-Length 无效")
+        if content_length > self.server.max_body_size:
+            return self._send_error(413, f"请求体超过 {self.server.max_body_size} 字节")
+        post_data = self.rfile.read(content_length)
+
+        status, headers, response = handle_notification_post(
+            self.server.daemon, post_data, self.headers.get('Content-Type', ''),
+            client=self.client_address[0]
+        )
+        self._set_response(status, "application/json", headers)
+        self.wfile.write(response.encode('utf-8'))
+
+    def _send_error(self, status, message):
+        self.close_connection = True
+        self._set_response(status, "application/json")
+        self.wfile.write(error_response(message).encode('utf-8'))
+
+    def do_GET(self):
+        status, content_type, body = handle_metrics_get(self.server.daemon, self.path)
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+class NotificationHTTPServer(ThreadingHTTPServer):
+    """线程版接收服务，监听队列比默认的5更长，突发的并发连接不会被直接重置"""
+    request_queue_size = 128
+
+    def __init__(self, server_address, daemon, max_body_size=MAX_BODY_SIZE):
+        self.daemon = daemon
+        self.max_body_size = max_body_size
+        super().__init__(server_address, NotificationHandler)
+
+class AsyncNotificationServer:
+    """基于asyncio的通知接收服务
+
+    与 NotificationHandler 使用相同的POST接口和 GET /metrics、/stats，支持HTTP/1.1长连接，
+    所有连接在同一个事件循环线程中处理，并发连接数受 max_connections 限制。
+    """
+    IDLE_TIMEOUT = 30  # 秒，长连接空闲超时
+    MAX_HEADER_LINES = 100
+
+    def __init__(self, daemon, server_address, max_connections=100, max_body_size=MAX_BODY_SIZE):
+        self.daemon = daemon
+        self.server_address = server_address
+        self.max_connections = max_connections
+        self.max_body_size = max_body_size
+        self.loop = None
+        self._stop_event = None
+        self._stop_requested = threading.Event()  # 事件循环启动前调用 shutdown 时由 _serve 检查
+        self._connections = set()
+
+    def serve_forever(self):
+        import asyncio  # 导入较慢，只在使用 asyncio 接收服务时导入
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        finally:
+            self.loop.close()
+
+    def shutdown(self):
+        """可在任意线程调用，取消所有连接并停止事件循环；在服务启动前调用时服务启动后立即退出"""
+        self._stop_requested.set()
+        if self.loop and self._stop_event and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
+    async def _serve(self):
+        import asyncio
+        self._stop_event = asyncio.Event()
+        if self._stop_requested.is_set():
+            return
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        host, port = self.server_address
+        server = await asyncio.start_server(
+            self._handle_connection, host or None, port, reuse_address=True
+        )
+        async with server:
+            await self._stop_event.wait()
+            server.close()
+            for task in list(self._connections):
+                task.cancel()
+            if self._connections:
+                await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle_connection(self, reader, writer):
+        import asyncio
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            async with self._semaphore:
+                while await self._handle_request(reader, writer):
+                    pass
+        except (asyncio.CancelledError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.error(f"处理连接出错: {str(e)}")
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _handle_request(self, reader, writer):
+        """处理一个请求，返回是否保持连接"""
+        import asyncio
+        request_line = await asyncio.wait_for(reader.readline(), self.IDLE_TIMEOUT)
+        if not request_line:
+            return False
+
+        try:
+            method, path, version = request_line.decode('latin-1').split()
+        except ValueError:
+            await self._write_response(writer, 400, "text/plain", b"Bad Request", False)
+            return False
+
+        headers = {}
+        for _ in range(self.MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            # 剩余的头部无法与请求体区分，响应后关闭连接
+            await self._write_response(
+                writer, 431, "text/plain", b"Request Header Fields Too Large", False
+            )
+            return False
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+
+        # 请求体大小先于读取检查；出错时无法确定请求边界，响应后关闭连接
+        content_length = headers.get("content-length")
+        if content_length is None and method == "POST":
+            await self._write_response(
+                writer, 411, "application/json", error_response("缺少 Content-Length").encode('utf-8'), False
+            )
+            return False
+        try:
+            content_length = int(content_length or 0)
+            if content_length < 0:
+                raise ValueError
+        except ValueError:
+            await self._write_response(writer, 400, "text/plain", b"Bad Request", False)
+            return False
+        if content_length > self.max_body_size:
+            message = f"请求体超过 {self.max_body_size} 字节"
+            await self._write_response(
+                writer, 413, "application/json", error_response(message).encode('utf-8'), False
+            )
+            return False
+
+        body = b""
+        if content_length:
+            body = await reader.readexactly(content_length)
+
+        if method == "GET":
+            status, content_type, response = handle_metrics_get(self.daemon, path)
+            await self._write_response(writer, status, content_type, response, keep_alive)
+            return keep_alive
+        if method != "POST":
+            await self._write_response(writer, 405, "text/plain", b"Method Not Allowed", keep_alive)
+            return keep_alive
+
+        peer = writer.get_extra_info("peername")
+        status, extra_headers, response = handle_notification_post(
+            self.daemon, body, headers.get("content-type", ""),
+            client=peer[0] if peer else None
+        )
+        await self._write_response(
+            writer, status, "application/json", response.encode('utf-8'), keep_alive, extra_headers
+        )
+        return keep_alive
+
+    async def _write_response(self, writer, status, content_type, body, keep_alive, headers=None):
+        reason = HTTPStatus(status).phrase
+        extra = "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+        head = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"{extra}"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+def remove_stale_socket(path):
+    """上次异常退出可能留下套接字文件，确认没有进程在监听后再删除，有进程在监听时抛出 OSError"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        raise OSError(f"{path} 已有其他进程在监听")
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    finally:
+        probe.close()
+
+def bind_private_socket(sock, path):
+    """绑定Unix套接字，套接字文件只允许当前用户访问"""
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    finally:
+        os.umask(old_umask)
+    os.chmod(path, 0o600)
+
+def peer_client(sock):
+    """本地套接字对端的限速标识，取自 SO_PEERCRED 中的用户id
+
+    与HTTP接口按IP限速一样按来源而不是按连接计算，重新连接或每次启动新进程发送都计入同一个配额。
+    不支持 SO_PEERCRED 的平台上返回 "unix"：套接字权限为0600，能连接的本来就只有当前用户。
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        return "unix"
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", creds)
+    return f"unix:uid={uid}"
+
+class IngestHandler(socketserver.StreamRequestHandler):
+    """本地套接字接收：每行一个JSON对象或JSON数组，每行返回一行JSON响应
+
+    响应内容与HTTP接口相同，同一连接可以连续发送多行，不需要等待响应。
+    被限速或接收队列已满时，响应中的 retry_after 给出建议的重试间隔（秒）。按对端用户限速，见 peer_client。
+    """
+
+    def handle(self):
+        max_line = self.server.max_body_size
+        client = peer_client(self.request)
+        try:
+            while True:
+                line = self.rfile.readline(max_line + 1)
+                if not line:
+                    break
+                if len(line) > max_line and not line.endswith(b"\n"):
+                    message = f"单行超过 {max_line} 字节，连接已关闭"
+                    self.wfile.write(error_response(message).encode('utf-8') + b"\n")
+                    break
+                if not line.strip():
+                    continue
+                _, _, response = handle_notification_post(
+                    self.server.daemon, line, "application/json", transport="unix", client=client
+                )
+                self.wfile.write(response.encode('utf-8') + b"\n")
+        except OSError:
+            pass  # 客户端提前断开
+
+class UnixIngestServer(socketserver.ThreadingUnixStreamServer):
+    """APP_DIR/ingest.sock 上的通知接收服务，本机程序不经过TCP和HTTP解析即可发送通知"""
+    daemon_threads = True
+
+    def __init__(self, path, daemon, max_body_size=MAX_BODY_SIZE):
+        remove_stale_socket(path)
+        self.daemon = daemon
+        self.max_body_size = max_body_size
+        super().__init__(path, IngestHandler)
+
+    def server_bind(self):
+        bind_private_socket(self.socket, self.server_address)
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+def make_history_records(notifications):
+    """把收到的通知转换为待写入历史的记录，没有时间戳的使用当前时间"""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return [{
+        "title": notification["title"],
+        "message": notification["message"],
+        "timestamp": notification.get("timestamp") or now,
+        "source": notification.get("source", "local"),
+        "read": False,
+        "received_at": notification.get("received_at"),
+        "journal_seq": notification.get("journal_seq")
+    } for notification in notifications]
+
+class HistoryStore:
+    """基于SQLite(WAL模式)的通知历史持久化存储
+
+    写操作在调用线程中只做入队，由后台线程批量提交；尚未提交的写入会叠加到查询结果上，
+    因此读到的始终是最新状态。未读数和总数在内存中增量维护。
+    因数据库繁忙或被锁定而提交失败的批次保留下来，按递增的间隔重试，新的写入在它之后排队；
+    其他错误（如约束冲突）时逐条写入，无法写入的通知记录日志后丢弃，并相应调整未读数和总数。
+    通知带 journal_seq（接收日志序号）时，已提交的最大序号与通知在同一事务中记入 meta 表。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp TEXT,
+            source TEXT NOT NULL DEFAULT 'local',
+            read INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_notifications_timestamp ON notifications(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(read, id);
+        CREATE INDEX IF NOT EXISTS idx_notifications_source ON notifications(source, id);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+    MAX_RETRY_DELAY = 30  # 秒，提交失败后重试的最长间隔
+    INSERT_ROW = (
+        "INSERT OR REPLACE INTO notifications "
+        "(id, title, message, timestamp, source, read, created_at) "
+        "VALUES (:id, :title, :message, :timestamp, :source, :read, :created_at)"
+    )
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closing = False
+        self._pending = self._new_batch()
+        self._committing = self._new_batch()
+
+        # 读连接可在任意线程使用，由 NotificationDaemon.lock 保证同一时刻只有一个线程使用
+        self._conn = self._connect(check_same_thread=False)
+        self._conn.executescript(self.SCHEMA)
+        self._next_id = (self._conn.execute("SELECT MAX(id) FROM notifications").fetchone()[0] or 0) + 1
+        self.total_count = self._conn.execute("SELECT COUNT(*) FROM notifications").fetchone()[0]
+        self.unread_count = self._conn.execute(
+            "SELECT COUNT(*) FROM notifications WHERE read = 0"
+        ).fetchone()[0]
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'journal_seq'").fetchone()
+        self.journal_seq = row[0] if row else 0  # 已提交到数据库的接收日志最大序号
+
+        self._writer = threading.Thread(target=self._write_loop, name="HistoryWriter", daemon=True)
+        self._writer.start()
+
+    def _connect(self, check_same_thread=True):
+        import sqlite3  # 通知核心在托盘图标显示后才创建，sqlite3 随之导入
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=check_same_thread)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @staticmethod
+    def _new_batch():
+        return {"rows": {}, "read_ids": set(), "read_all_upto": 0, "journal_seq": 0}
+
+    def add(self, notifications):
+        """为通知分配id并排队写入，notifications 中的字典会被补充 id 字段"""
+        now = time.time()
+        with self._lock:
+            for notification in notifications:
+                notification["id"] = self._next_id
+                self._next_id += 1
+                self._pending["rows"][notification["id"]] = {
+                    "id": notification["id"],
+                    "title": notification["title"],
+                    "message": notification["message"],
+                    "timestamp": notification.get("timestamp"),
+                    "source": notification.get("source", "local"),
+                    "read": bool(notification.get("read", False)),
+                    "created_at": now
+                }
+                if not notification.get("read", False):
+                    self.unread_count += 1
+                if notification.get("journal_seq"):
+                    self._pending["journal_seq"] = max(self._pending["journal_seq"], notification["journal_seq"])
+            self.total_count += len(notifications)
+            self._wakeup.notify()
+
+    def advance_journal_seq(self, journal_seq):
+        """把检查点推进到 journal_seq，用于跳过接收日志中无法写入历史的记录"""
+        with self._lock:
+            self._pending["journal_seq"] = max(self._pending["journal_seq"], journal_seq)
+            self._wakeup.notify()
+
+    def pending_count(self):
+        """尚未提交到数据库的新通知数"""
+        return len(self._pending["rows"]) + len(self._committing["rows"])
+
+    def mark_read(self, notification_ids):
+        """将通知标记为已读，调用方只传入当前处于未读状态的通知id"""
+        with self._lock:
+            for notification_id in notification_ids:
+                row = self._pending["rows"].get(notification_id)
+                if row is not None:
+                    if row["read"]:
+                        continue
+                    row["read"] = True
+                else:
+                    self._pending["read_ids"].add(notification_id)
+                self.unread_count -= 1
+            self._wakeup.notify()
+
+    def mark_all_read(self):
+        with self._lock:
+            for row in self._pending["rows"].values():
+                row["read"] = True
+            self._pending["read_all_upto"] = self._next_id - 1
+            self.unread_count = 0
+            self._wakeup.notify()
+
+    def recent(self, limit):
+        """返回最近的 limit 条通知，按时间从新到旧排列"""
+        return self.fetch_page(None, limit)
+
+    def fetch_page(self, before_id, limit):
+        """分页查询：返回 id 小于 before_id 的最近 limit 条通知（从新到旧）"""
+        if before_id is None:
+            before_id = sys.maxsize
+
+        with self._lock:
+            batches = [self._committing, self._pending]
+            overlay_rows = {}
+            read_ids = set()
+            read_all_upto = 0
+            for batch in batches:
+                # id单调递增，从尾部取最多 limit 条即可
+                for notification_id in itertools.islice(
+                        (k for k in reversed(batch["rows"]) if k < before_id), limit):
+                    overlay_rows[notification_id] = dict(batch["rows"][notification_id])
+                read_ids |= batch["read_ids"]
+                read_all_upto = max(read_all_upto, batch["read_all_upto"])
+
+        result = {row["id"]: row for row in self.query_page(self._conn, before_id, limit)}
+        for notification_id, row in overlay_rows.items():
+            result[notification_id] = {k: v for k, v in row.items() if k != "created_at"}
+
+        page = sorted(result.values(), key=lambda n: n["id"], reverse=True)[:limit]
+        for notification in page:
+            if notification["id"] in read_ids or notification["id"] <= read_all_upto:
+                notification["read"] = True
+        return page
+
+    @staticmethod
+    def query_page(conn, before_id, limit):
+        """只查询已提交到数据库的部分，返回 id 小于 before_id 的最近 limit 条通知（从新到旧）"""
+        if before_id is None:
+            before_id = sys.maxsize
+        rows = conn.execute(
+            "SELECT id, title, message, timestamp, source, read FROM notifications "
+            "WHERE id < ? ORDER BY id DESC LIMIT ?",
+            (before_id, limit)
+        ).fetchall()
+        return [{
+            "id": row["id"],
+            "title": row["title"],
+            "message": row["message"],
+            "timestamp": row["timestamp"],
+            "source": row["source"],
+            "read": bool(row["read"])
+        } for row in rows]
+
+    def filter_unread(self, notification_ids):
+        """返回 notification_ids 中当前仍为未读的id，用于去掉多个前端重复的已读标记"""
+        unread = []
+        committed = []
+        with self._lock:
+            batches = [self._committing, self._pending]
+            for notification_id in notification_ids:
+                if any(notification_id in batch["read_ids"] or notification_id <= batch["read_all_upto"]
+                       for batch in batches):
+                    continue
+                row = self._pending["rows"].get(notification_id) or self._committing["rows"].get(notification_id)
+                if row is None:
+                    committed.append(notification_id)
+                elif not row["read"]:
+                    unread.append(notification_id)
+
+        for start in range(0, len(committed), 500):
+            chunk = committed[start:start + 500]
+            unread.extend(row["id"] for row in self._conn.execute(
+                f"SELECT id FROM notifications WHERE read = 0 AND id IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return unread
+
+    def _write_loop(self):
+        import sqlite3
+        conn = self._connect()
+        retry_delay = 0
+        while True:
+            with self._lock:
+                # 上一批提交失败时 _committing 仍保留着它，先重试这一批
+                if not self._has_changes(self._committing):
+                    while not self._closing and not self._has_changes(self._pending):
+                        self._wakeup.wait()
+                    if not self._has_changes(self._pending):
+                        break
+                    self._committing, self._pending = self._pending, self._new_batch()
+                batch = self._committing
+
+            dropped = []
+            committed = True
+            try:
+                self._commit_batch(conn, batch)
+            except sqlite3.Error as e:
+                if self._is_transient(e):
+                    if self._closing and retry_delay:
+                        logging.error(f"写入通知历史失败，关闭时放弃未提交的写入: {str(e)}")
+                        break
+                    retry_delay = min(self.MAX_RETRY_DELAY, retry_delay * 2 or 0.5)
+                    logging.error(f"写入通知历史失败，{retry_delay} 秒后重试: {str(e)}")
+                    with self._lock:
+                        self._wakeup.wait_for(lambda: self._closing, retry_delay)
+                    continue
+                logging.error(f"写入通知历史失败，改为逐条写入: {str(e)}")
+                dropped, committed = self._salvage_batch(conn, batch)
+
+            retry_delay = 0
+            with self._lock:
+                if committed:
+                    self.journal_seq = max(self.journal_seq, batch["journal_seq"])
+                self.total_count -= len(dropped)
+                self.unread_count -= sum(1 for row in dropped if not row["read"])
+                self._committing = self._new_batch()
+        conn.close()
+
+    @staticmethod
+    def _has_changes(batch):
+        return bool(batch["rows"] or batch["read_ids"] or batch["read_all_upto"] or batch["journal_seq"])
+
+    @staticmethod
+    def _is_transient(error):
+        """数据库繁忙或被锁定，稍后重试可以成功"""
+        import sqlite3
+        if not isinstance(error, sqlite3.OperationalError):
+            return False
+        name = getattr(error, "sqlite_errorname", "")
+        return name in ("SQLITE_BUSY", "SQLITE_LOCKED") or "locked" in str(error) or "busy" in str(error)
+
+    def _salvage_batch(self, conn, batch):
+        """整批提交失败时逐条写入通知，再提交已读状态和接收日志序号
+
+        返回 (无法写入而丢弃的行, 其余部分是否已提交)。
+        """
+        import sqlite3
+        dropped = []
+        for row in batch["rows"].values():
+            try:
+                with conn:
+                    conn.execute(self.INSERT_ROW, row)
+            except sqlite3.Error as e:
+                logging.error(f"通知无法写入历史，已丢弃: {str(e)}: {row}")
+                dropped.append(row)
+        try:
+            self._commit_batch(conn, dict(batch, rows={}))
+        except sqlite3.Error as e:
+            logging.error(f"写入已读状态失败，已丢弃: {str(e)}")
+            return dropped, False
+        return dropped, True
+
+    @classmethod
+    def _commit_batch(cls, conn, batch):
+        with conn:
+            if batch["rows"]:
+                conn.executemany(cls.INSERT_ROW, list(batch["rows"].values()))
+            if batch["read_ids"]:
+                conn.executemany(
+                    "UPDATE notifications SET read = 1 WHERE id = ?",
+                    [(notification_id,) for notification_id in batch["read_ids"]]
+                )
+            if batch["read_all_upto"]:
+                conn.execute(
+                    "UPDATE notifications SET read = 1 WHERE read = 0 AND id <= ?",
+                    (batch["read_all_upto"],)
+                )
+            if batch["journal_seq"]:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES ('journal_seq', ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)",
+                    (batch["journal_seq"],)
+                )
+
+    def checkpoint(self):
+        """把已提交的写入同步到磁盘，返回其中包含的接收日志最大序号；检查点没有完成时返回 None
+
+        synchronous=NORMAL 时WAL只在检查点时 fsync，清理接收日志前需要先调用。
+        """
+        import sqlite3
+        with self._lock:
+            journal_seq = self.journal_seq
+        try:
+            busy, log_frames, checkpointed = self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"通知历史检查点失败: {str(e)}")
+            return None
+        if busy or checkpointed < log_frames:
+            return None
+        return journal_seq
+
+    def close(self):
+        """提交所有待写入数据并关闭"""
+        with self._lock:
+            self._closing = True
+            self._wakeup.notify()
+        self._writer.join(5)
+        self._conn.close()
+
+class PollStateStore:
+    """轮询状态（ETag、Last-Modified、游标）的持久化，按数据源名称分别保存
+
+    同一地址可以配置成多个请求头或游标参数不同的数据源，因此不按地址保存；旧版本按地址保存的状态通过
+    get 的 fallback_key 继续使用。
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+        self._state = {}
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取轮询状态失败，将重新开始: {str(e)}")
+
+    def get(self, key, fallback_key=None):
+        with self._lock:
+            if key not in self._state and fallback_key in self._state:
+                return dict(self._state[fallback_key])
+            return dict(self._state.get(key, {}))
+
+    def update(self, key, **values):
+        with self._lock:
+            entry = self._state.setdefault(key, {})
+            changed = False
+            for name, value in values.items():
+                if value is not None and entry.get(name) != value:
+                    entry[name] = value
+                    changed = True
+            if changed:
+                self._save()
+
+    def _save(self):
+        tmp_file = self.state_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._state, f, ensure_ascii=False)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logging.error(f"保存轮询状态失败: {str(e)}")
+
+class NotificationDeduper:
+    """基于有界LRU的通知去重，本地接收和远端轮询共用
+
+    通知带 id 字段时按 (来源, id) 去重，否则按来源、标题、内容和时间戳的哈希去重。
+    既没有 id 也没有时间戳的通知无法区分是否重复，始终放行。
+    """
+
+    def __init__(self, state_file, capacity=10000):
+        self.state_file = state_file
+        self.capacity = capacity
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(state_file, "r", encoding="utf-8") as f:
+                for key in json.load(f)[-capacity:]:
+                    self._seen[key] = None
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取去重记录失败: {str(e)}")
+
+    @staticmethod
+    def key_for(notification):
+        source = notification.get("source", "local")
+        if notification.get("id") is not None:
+            return f"{source}|id:{notification['id']}"
+        if not notification.get("timestamp"):
+            return None
+        content = "\x1f".join([
+            source, notification["title"], notification["message"], str(notification["timestamp"])
+        ])
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def filter(self, notifications):
+        """返回与 notifications 一一对应的布尔列表，True 表示首次出现"""
+        flags = []
+        with self._lock:
+            for notification in notifications:
+                key = self.key_for(notification)
+                if key is None:
+                    flags.append(True)
+                elif key in self._seen:
+                    self._seen.move_to_end(key)
+                    flags.append(False)
+                else:
+                    self._seen[key] = None
+                    if len(self._seen) > self.capacity:
+                        self._seen.popitem(last=False)
+                    self._dirty = True
+                    flags.append(True)
+        return flags
+
+    def forget(self, notifications):
+        """撤销 filter 记下的去重记录，用于接收后又没能保存的通知，客户端重试时不会被当作重复"""
+        with self._lock:
+            for notification in notifications:
+                key = self.key_for(notification)
+                if key in self._seen:
+                    del self._seen[key]
+                    self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            keys = list(self._seen)
+            self._dirty = False
+
+        tmp_file = self.state_file + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(keys, f)
+            os.replace(tmp_file, self.state_file)
+        except OSError as e:
+            logging.error(f"保存去重记录失败: {str(e)}")
+
+class Metrics:
+    """线程安全的运行指标，可输出 Prometheus 文本格式或 JSON 快照
+
+    计数器和直方图由各线程直接更新；队列深度等瞬时值由 collectors 中的回调在读取时采集。
+    """
+    PREFIX = "notifypi_"
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    DEFINITIONS = {
+        "received": ("counter", "收到的通知数（含重复）"),
+        "dedup_dropped": ("counter", "因重复被丢弃的通知数"),
+        "rejected": ("counter", "因限速或接收队列已满被拒绝的请求数"),
+        "coalesced": ("counter", "被合并展示、没有单独弹窗的通知数"),
+        "native_dropped": ("counter", "系统通知队列已满被丢弃的条数"),
+        "native_rate_limited": ("counter", "系统通知超过限速被丢弃的条数"),
+        "log_dropped": ("counter", "日志队列已满被丢弃的条数"),
+        "polls": ("counter", "远端数据源轮询次数"),
+        "poll_latency_seconds": ("histogram", "远端数据源请求耗时"),
+        "display_latency_seconds": ("histogram", "通知从收到到展示的延迟"),
+        "event_loop_lag_seconds": ("histogram", "GUI事件循环延迟"),
+        "queue_depth": ("gauge", "各队列当前长度"),
+        "unread": ("gauge", "未读通知数"),
+        "history_total": ("gauge", "历史通知总数"),
+        "frontends": ("gauge", "连接到守护进程的托盘前端数"),
+        "uptime_seconds": ("gauge", "运行时长"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+        self.collectors = []
+        self.started = time.monotonic()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "buckets": [0] * len(self.BUCKETS), "count": 0, "sum": 0.0, "max": 0.0
+                }
+            index = bisect.bisect_left(self.BUCKETS, value)
+            if index < len(self.BUCKETS):
+                histogram["buckets"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+            histogram["max"] = max(histogram["max"], value)
+
+    def _collect(self):
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logging.debug(f"采集运行指标失败: {str(e)}")
+        self.set("uptime_seconds", round(time.monotonic() - self.started, 3))
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: dict(h, buckets=list(h["buckets"])) for key, h in self._histograms.items()}
+        return values, histograms
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ""
+        pairs = []
+        for name, value in labels:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{name}="{value}"')
+        return "{" + ",".join(pairs) + "}"
+
+    def render_prometheus(self):
+        values, histograms = self._collect()
+        lines = []
+        for name, (kind, description) in self.DEFINITIONS.items():
+            metric = self.PREFIX + name + ("_total" if kind == "counter" else "")
+            samples = sorted(((labels, v) for (n, labels), v in values.items() if n == name), key=lambda x: x[0])
+            series = sorted(((labels, h) for (n, labels), h in histograms.items() if n == name), key=lambda x: x[0])
+            if not samples and not series:
+                continue
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for labels, value in samples:
+                lines.append(f"{metric}{self._format_labels(labels)} {value}")
+            for labels, histogram in series:
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{self._format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{metric}_bucket{self._format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+                lines.append(f"{metric}_sum{self._format_labels(labels)} {histogram['sum']:.6f}")
+                lines.append(f"{metric}_count{self._format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """返回按指标名和标签值嵌套的字典，直方图给出次数、平均值和估算的 p50/p99"""
+        values, histograms = self._collect()
+        result = {}
+        items = list(values.items()) + [(key, self._summarize(h)) for key, h in histograms.items()]
+        for (name, labels), value in items:
+            if not labels:
+                result[name] = value
+                continue
+            node = result.setdefault(name, {})
+            for _, label_value in labels[:-1]:
+                node = node.setdefault(str(label_value), {})
+            node[str(labels[-1][1])] = value
+        return result
+
+    def _summarize(self, histogram):
+        count = histogram["count"]
+        summary = {
+            "count": count,
+            "avg": round(histogram["sum"] / count, 6) if count else 0.0,
+            "max": round(histogram["max"], 6)
+        }
+        for name, quantile in (("p50", 0.5), ("p99", 0.99)):
+            # 取累计次数首次达到分位点的桶上界，超出最大桶时用最大值
+            target = quantile * count
+            cumulative = 0
+            summary[name] = summary["max"]
+            for bound, bucket_count in zip(self.BUCKETS, histogram["buckets"]):
+                cumulative += bucket_count
+                if count and cumulative >= target:
+                    summary[name] = min(bound, summary["max"])
+                    break
+        return summary
+
+class DroppingQueueHandler(QueueHandler):
+    """写入有界队列的日志处理器，队列满时丢弃日志而不是阻塞调用线程
+
+    丢弃的条数会在队列恢复后以一条警告日志报告。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._unreported = 0
+        self._lock = threading.Lock()
+
+    def enqueue(self, record):
+        with self._lock:
+            if self._unreported and self._put(self._drop_report(record)):
+                self._unreported = 0
+            if not self._put(record):
+                self.dropped += 1
+                self._unreported += 1
+
+    def _put(self, record):
+        try:
+            self.queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return False
+
+    def _drop_report(self, record):
+        report = logging.LogRecord(
+            record.name, logging.WARNING, __file__, 0,
+            f"日志队列已满，丢弃了 {self._unreported} 条日志", None, None
+        )
+        report.event = "log_dropped"
+        report.count = self._unreported
+        return report
+
+class JsonLogFormatter(logging.Formatter):
+    """JSON Lines 日志格式，每行一个对象
+
+    ts、level、event 固定排在最前面，LogIndex 只需匹配行首即可建立索引；
+    source、latency_ms、count、error 通过 logging 的 extra 参数传入，没有时省略。
+    """
+    FIELDS = ("source", "latency_ms", "count", "error")
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "event": getattr(record, "event", "log"),
+            "msg": record.getMessage()
+        }
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+class QueuedLogging:
+    """根日志器写入 APP_DIR 下的日志文件（按大小轮转）和控制台，由后台线程完成，调用方只做入队
+
+    日志文件的格式由 log_format 设置决定，控制台始终输出文本。
+    """
+    QUEUE_SIZE = 10000
+
+    def __init__(self, settings, filename):
+        self.settings = settings
+        os.makedirs(APP_DIR, exist_ok=True)
+        self.path = os.path.join(APP_DIR, filename)
+        self.file_handler = RotatingFileHandler(self.path, maxBytes=1024*1024, backupCount=5)
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(self.text_formatter())
+        self.handlers = [self.file_handler, console_handler]
+
+        self.queue_handler = DroppingQueueHandler(queue.Queue(maxsize=self.QUEUE_SIZE))
+        self.listener = QueueListener(self.queue_handler.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self.logger = logging.getLogger()
+        self.logger.setLevel(logging.INFO)
+        self.logger.addHandler(self.queue_handler)
+        self.apply_format()
+
+    @staticmethod
+    def text_formatter():
+        return logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    def apply_format(self):
+        """按设置切换日志文件的格式"""
+        if self.settings.value("log_format", "text") == "json":
+            self.file_handler.setFormatter(JsonLogFormatter(datefmt='%Y-%m-%d %H:%M:%S'))
+        else:
+            self.file_handler.setFormatter(self.text_formatter())
+
+    def stop(self):
+        """写完队列中剩余的日志，之后的日志改为直接同步写入"""
+        self.listener.stop()
+        self.logger.removeHandler(self.queue_handler)
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+            handler.flush()
+
+class TokenBucket:
+    """令牌桶限流：rate 为每秒补充的令牌数，capacity 为允许的突发量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount=1):
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return True
+            return False
+
+    def retry_after(self, amount=1):
+        """距离可以再取到 amount 个令牌还需要的秒数"""
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount or self.rate <= 0:
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+def load_poll_sources(settings):
+    """读取远端数据源列表，兼容旧版单一 api_url/poll_interval 配置"""
+    raw = settings.value("api_sources", "")
+    if raw:
+        try:
+            sources = json.loads(raw)
+        except ValueError:
+            logging.error("数据源配置不是有效的JSON，已忽略")
+            sources = []
+    else:
+        api_url = settings.value("api_url", "")
+        sources = [{
+            "name": "默认",
+            "url": api_url,
+            "interval": settings.value("poll_interval", 300, type=int),
+            "cursor_param": settings.value("api_cursor_param", "")
+        }] if api_url else []
+
+    # 名称用作通知来源和轮询状态的键，重名时加序号区分
+    configs = []
+    names = set()
+    for source in sources:
+        if not source.get("url"):
+            continue
+        base_name = source.get("name") or source["url"]
+        name = base_name
+        for index in itertools.count(2):
+            if name not in names:
+                break
+            name = f"{base_name} ({index})"
+        names.add(name)
+        configs.append({
+            "name": name,
+            "url": source["url"],
+            "interval": int(source.get("interval", 300)),
+            "timeout": int(source.get("timeout", 10)),
+            "headers": source.get("headers") or {},
+            "cursor_param": source.get("cursor_param", ""),
+            "enabled": bool(source.get("enabled", True)),
+            "mode": source.get("mode", "poll")
+        })
+    return configs
+
+class PollSource:
+    """一个远端数据源的配置及其调度状态
+
+    轮询间隔根据结果自适应调整：出错时按指数退避（带随机抖动），连续失败达到阈值后熔断，
+    熔断期满后先发一次试探请求；拿到新通知后临时缩短间隔，以便更快获取后续通知。
+    """
+    FAILURE_THRESHOLD = 5  # 连续失败次数达到后熔断
+    CIRCUIT_OPEN_TIME = 300  # 秒
+    MAX_BACKOFF = 1800  # 秒
+    FAST_POLLS = 5  # 收到通知后加速轮询的次数
+    FAST_DIVISOR = 4
+    MIN_INTERVAL = 2  # 秒
+    JITTER = 0.1
+
+    def __init__(self, config):
+        self.name = config["name"]
+        self.url = config["url"]
+        self.interval = config["interval"]
+        self.timeout = config["timeout"]
+        self.headers = config["headers"]
+        self.cursor_param = config["cursor_param"]
+        self.enabled = config["enabled"]
+        self.mode = config["mode"]
+        self.next_due = 0.0
+        self.in_flight = False
+        self.failures = 0
+        self.circuit = "closed"  # closed / open / half_open
+        self.fast_polls_left = 0
+        self.last_delay = 0.0
+
+    def record_result(self, count):
+        """记录一次轮询结果（count 为获取到的通知数，失败时为 None），返回距下次轮询的秒数"""
+        if count is None:
+            self.failures += 1
+            self.fast_polls_left = 0
+            if self.failures >= self.FAILURE_THRESHOLD:
+                if self.circuit != "open":
+                    logging.warning(
+                        f"数据源 {self.name} 连续失败 {self.failures} 次，暂停轮询 {self.CIRCUIT_OPEN_TIME} 秒",
+                        extra={"event": "circuit_open", "source": self.name, "count": self.failures}
+                    )
+                self.circuit = "open"
+                delay = self.CIRCUIT_OPEN_TIME
+            else:
+                # 指数退避，在 [delay/2, delay] 之间随机取值，避免多个客户端同时重试
+                delay = min(self.interval * 2 ** self.failures, self.MAX_BACKOFF)
+                delay = random.uniform(delay / 2, delay)
+        else:
+            if self.circuit != "closed":
+                logging.info(f"数据源 {self.name} 已恢复", extra={"event": "circuit_closed", "source": self.name})
+            self.failures = 0
+            self.circuit = "closed"
+            if count:
+                self.fast_polls_left = self.FAST_POLLS
+            if self.fast_polls_left:
+                self.fast_polls_left -= 1
+                delay = min(max(self.interval / self.FAST_DIVISOR, self.MIN_INTERVAL), self.interval)
+            else:
+                delay = self.interval
+            delay *= random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+        self.last_delay = delay
+        return delay
+
+    def status_text(self):
+        if self.mode != "poll":
+            return "推送重连中" if self.failures else "推送中"
+        if self.circuit == "open":
+            return f"已熔断，{self.last_delay:.0f}秒后试探"
+        if self.circuit == "half_open":
+            return "试探中"
+        if self.failures:
+            return f"连续失败{self.failures}次，{self.last_delay:.0f}秒后重试"
+        if self.fast_polls_left:
+            return "加速轮询"
+        return "正常"
+
+class PollScheduler:
+    """多数据源并发轮询调度器
+
+    每个数据源按自己的间隔调度（从上一次请求结束时开始计时），同一数据源的请求不会重叠。
+    到期的数据源提交到线程池并发执行，相邻两次发起之间至少间隔 STAGGER 秒，避免同时触发。
+    """
+    STAGGER = 0.5  # 秒
+
+    def __init__(self, fetch, max_workers=8, on_state_change=None):
+        from concurrent.futures import ThreadPoolExecutor  # 导入较慢，创建轮询调度器时才导入
+        self.fetch = fetch
+        self.on_state_change = on_state_change
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="PollWorker")
+        self.sources = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._last_dispatch = 0.0
+        self._thread = threading.Thread(target=self._run, name="PollScheduler", daemon=True)
+        self._thread.start()
+
+    def set_sources(self, sources, initial_delay=0):
+        with self._cond:
+            now = time.monotonic()
+            self.sources = [source for source in sources if source.enabled]
+            for index, source in enumerate(self.sources):
+                source.next_due = now + initial_delay + index * self.STAGGER
+            self._cond.notify()
+
+    def poll_now(self):
+        """让所有数据源尽快轮询一次（仍然错开发起）"""
+        with self._cond:
+            now = time.monotonic()
+            for source in self.sources:
+                source.next_due = min(source.next_due, now)
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self):
+        with self._cond:
+            while not self._stopping:
+                now = time.monotonic()
+                idle = [source for source in self.sources if not source.in_flight]
+                due = [source for source in idle if source.next_due <= now]
+
+                if due and now - self._last_dispatch >= self.STAGGER:
+                    source = min(due, key=lambda s: s.next_due)
+                    source.in_flight = True
+                    if source.circuit == "open":
+                        source.circuit = "half_open"
+                    self._last_dispatch = now
+                    self.executor.submit(self._execute, source)
+                    continue
+
+                if due:
+                    timeout = self._last_dispatch + self.STAGGER - now
+                elif idle:
+                    timeout = min(source.next_due for source in idle) - now
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+
+    def _execute(self, source):
+        count = None
+        try:
+            count = self.fetch(source)
+        except Exception as e:
+            logging.error(f"轮询数据源 {source.name} 出错: {str(e)}", extra={
+                "event": "poll_error", "source": source.name, "error": str(e)
+            })
+        finally:
+            with self._cond:
+                source.in_flight = False
+                source.next_due = time.monotonic() + source.record_result(count)
+                self._cond.notify()
+            if self.on_state_change:
+                self.on_state_change()
+
+class StreamClient:
+    """远端数据源的推送客户端，支持 SSE 和 HTTP 长轮询
+
+    在独立线程中保持连接，通知到达后立即交给 on_data 处理。连接断开后自动重连，
+    SSE 模式会携带 Last-Event-ID 从上次收到的事件之后继续。
+    """
+    DEFAULT_RETRY = 3  # 秒，服务端可通过 retry 字段修改
+    MAX_RETRY = 60
+    MIN_LONG_POLL_GAP = 1  # 秒，服务端没有挂起请求时避免空转
+    READ_TIMEOUT = 90  # 秒，事件流这么久没有任何数据（包括心跳注释）时视为连接已半开，断开重连
+    STATE_SAVE_INTERVAL = 1  # 秒
+
+    def __init__(self, source, on_data, fetch, poll_state, on_state_change=None):
+        self.source = source
+        self.on_state_change = on_state_change
+        self.on_data = on_data
+        self.fetch = fetch
+        self.poll_state = poll_state
+        self.retry = self.DEFAULT_RETRY
+        self.last_event_id = poll_state.get(source.name, source.url).get("last_event_id")
+        self._saved_event_id = self.last_event_id
+        self._last_save = 0.0
+        self._stopped = threading.Event()
+        self._response = None
+        self._thread = threading.Thread(
+            target=self._run, name=f"StreamClient-{source.name}", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            response.close()
+        self._save_event_id(force=True)
+
+    def _run(self):
+        failures = 0
+        while not self._stopped.is_set():
+            if self.source.failures != failures:
+                self.source.failures = failures
+                if self.on_state_change:
+                    self.on_state_change()
+            started = time.monotonic()
+            try:
+                if self.source.mode == "sse":
+                    self._stream_events()
+                    delay = self.retry
+                else:
+                    if self.fetch(self.source) is None:
+                        raise ConnectionError("长轮询请求失败")
+                    elapsed = time.monotonic() - started
+                    delay = 0 if elapsed >= self.MIN_LONG_POLL_GAP else self.MIN_LONG_POLL_GAP
+                failures = 0
+            except Exception as e:
+                if self._stopped.is_set():
+                    break
+                failures += 1
+                delay = min(self.retry * 2 ** (failures - 1), self.MAX_RETRY)
+                delay = random.uniform(delay / 2, delay)
+                logging.warning(f"数据源 {self.source.name} 推送连接中断: {str(e)}，{delay:.0f} 秒后重连", extra={
+                    "event": "stream_error", "source": self.source.name, "error": str(e)
+                })
+            self._stopped.wait(delay)
+
+    def _stream_events(self):
+        headers = dict(self.source.headers)
+        headers["Accept"] = "text/event-stream"
+        headers["Cache-Control"] = "no-cache"
+        if self.last_event_id:
+            headers["Last-Event-ID"] = self.last_event_id
+
+        import requests
+        with requests.Session() as session:
+            response = session.get(
+                self.source.url, headers=headers, stream=True,
+                timeout=(self.source.timeout, self.READ_TIMEOUT)
+            )
+            self._response = response
+            try:
+                if response.status_code == 204:
+                    # 服务端要求暂停推送
+                    self.retry = self.MAX_RETRY
+                    return
+                response.raise_for_status()
+                logging.info(f"已连接数据源 {self.source.name} 的事件流", extra={
+                    "event": "stream_connected", "source": self.source.name
+                })
+                self._consume(response)
+            finally:
+                self._response = None
+                response.close()
+                self._save_event_id(force=True)
+
+    def _consume(self, response):
+        """按 text/event-stream 格式解析事件"""
+        data_lines = []
+        buffer = b""
+        for chunk in self._iter_chunks(response):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for raw_line in lines:
+                line = raw_line.rstrip(b"\r").decode("utf-8", errors="replace")
+                if not line:
+                    if data_lines:
+                        self._dispatch("\n".join(data_lines))
+                        data_lines = []
+                    continue
+                if line.startswith(":"):
+                    continue  # 注释/心跳
+                field, _, value = line.partition(":")
+                if value.startswith(" "):
+                    value = value[1:]
+                if field == "data":
+                    data_lines.append(value)
+                elif field == "id" and "\0" not in value:
+                    self.last_event_id = value
+                elif field == "retry" and value.isdigit():
+                    self.retry = int(value) / 1000
+
+    @staticmethod
+    def _iter_chunks(response):
+        # requests 创建的 raw 不解压，需要显式按 Content-Encoding 解码
+        raw = response.raw
+        if hasattr(raw, "read1"):
+            while True:
+                chunk = raw.read1(8192, decode_content=True)
+                if not chunk:
+                    return
+                yield chunk
+        else:
+            yield from response.iter_content(chunk_size=1)
+
+    def _dispatch(self, payload):
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            logging.error(f"数据源 {self.source.name} 推送的事件不是有效JSON")
+            return
+        if isinstance(data, list):
+            data = {"notifications": data}
+        elif isinstance(data, dict) and "notifications" not in data:
+            data = {"notifications": [data]}
+        self.on_data(data, self.source)
+        self._save_event_id()
+
+    def _save_event_id(self, force=False):
+        now = time.monotonic()
+        if self.last_event_id == self._saved_event_id:
+            return
+        if force or now - self._last_save >= self.STATE_SAVE_INTERVAL:
+            self.poll_state.update(self.source.name, last_event_id=self.last_event_id)
+            self._saved_event_id = self.last_event_id
+            self._last_save = now
+
+class RemotePoller:
+    """远端数据源的轮询和推送接收
+
+    新通知和状态变化分别通过 on_notifications(list) 和 on_status(str) 回调交给调用方，
+    回调在工作线程中执行。
+    """
+    MAX_WORKERS = 8
+
+    def __init__(self, on_notifications, on_status=None, deduper=None, metrics=None):
+        self.on_notifications = on_notifications
+        self.on_status = on_status
+        self.sources = []
+        self.deduper = deduper
+        self.metrics = metrics or Metrics()
+
+        # 请求在工作线程中并发执行，共享同一个连接池；首次请求时才创建，避免启动时导入 requests
+        self.session = None
+        self._session_lock = threading.Lock()
+        self.poll_state = PollStateStore(os.path.join(APP_DIR, "poll_state.json"))
+        self.scheduler = PollScheduler(self._fetch, self.MAX_WORKERS, self.emit_status)
+        self.stream_clients = []
+
+    def setup_polling(self, settings, initial_delay=0):
+        """按设置（QSettings 或 JsonSettings）重新配置数据源"""
+        self.stop_streams()
+        self.sources = []
+        if not settings.value("api_enabled", False, type=bool):
+            self.scheduler.set_sources([])
+            self.emit_status()
+            logging.info("远端API功能未启用")
+            return
+
+        sources = [PollSource(config) for config in load_poll_sources(settings)]
+        enabled = [source for source in sources if source.enabled]
+        self.sources = enabled
+        self.emit_status()
+        self.scheduler.set_sources(
+            [source for source in enabled if source.mode == "poll"], initial_delay
+        )
+        for source in enabled:
+            if source.mode != "poll":
+                client = StreamClient(
+                    source, self.process_api_response, self._fetch, self.poll_state, self.emit_status
+                )
+                client.start()
+                self.stream_clients.append(client)
+
+        if enabled:
+            summary = ", ".join(
+                f"{source.name}({source.interval}秒)" if source.mode == "poll"
+                else f"{source.name}({source.mode})"
+                for source in enabled
+            )
+            logging.info(f"已启用 {len(enabled)} 个远端数据源: {summary}")
+        else:
+            logging.warning("未配置可用的远端数据源")
+
+    def status_text(self):
+        return "\n".join(f"{source.name}: {source.status_text()}" for source in self.sources)
+
+    def emit_status(self):
+        """汇总各数据源状态，可在任意线程调用"""
+        if self.on_status:
+            self.on_status(self.status_text())
+
+    def stop_streams(self):
+        for client in self.stream_clients:
+            client.stop()
+        self.stream_clients = []
+
+    def poll_now(self):
+        self.scheduler.poll_now()
+
+    def _get_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        with self._session_lock:
+            if self.session is None:
+                adapter = HTTPAdapter(pool_connections=self.MAX_WORKERS, pool_maxsize=self.MAX_WORKERS)
+                self.session = requests.Session()
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            return self.session
+
+    def _fetch(self, source):
+        """在工作线程中执行，新通知通过 on_notifications 回调交给调用方
+
+        返回获取到的通知数，请求失败时返回 None。
+
+        携带上次响应的 ETag/Last-Modified 发起条件请求，内容未变化时服务端返回304，无需解析JSON；
+        配置了游标参数时只请求上次游标之后的新通知。
+        """
+        state = self.poll_state.get(source.name, source.url)
+        headers = dict(source.headers)
+        if state.get("etag"):
+            headers["If-None-Match"] = state["etag"]
+        if state.get("last_modified"):
+            headers["If-Modified-Since"] = state["last_modified"]
+        params = None
+        if source.cursor_param and state.get("cursor"):
+            params = {source.cursor_param: state["cursor"]}
+
+        import requests
+
+        # 连续失败时只在第一次记录错误，之后降为调试日志，避免刷屏
+        log = logging.error if source.failures == 0 else logging.debug
+        logging.debug(f"开始轮询API[{source.name}]: {source.url}")
+        started = time.monotonic()
+        response = None
+        try:
+            response = self._get_session().get(
+                source.url, headers=headers, params=params, timeout=source.timeout
+            )
+            latency_ms = round((time.monotonic() - started) * 1000)
+            self.metrics.observe("poll_latency_seconds", latency_ms / 1000, source=source.name)
+            if response.status_code == 304:
+                self.metrics.inc("polls", source=source.name, result="not_modified")
+                logging.info(f"API[{source.name}]内容未变化，耗时 {latency_ms} 毫秒", extra={
+                    "event": "poll_not_modified", "source": source.name, "latency_ms": latency_ms
+                })
+                return 0
+            if response.status_code == 200:
+                data = response.json()
+                count = self.process_api_response(data, source)
+                self.poll_state.update(
+                    source.name,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                    cursor=self.next_cursor(data, state.get("cursor"))
+                )
+                self.metrics.inc("polls", source=source.name, result="ok")
+                logging.info(f"API[{source.name}]轮询成功，耗时 {latency_ms} 毫秒", extra={
+                    "event": "poll_ok", "source": source.name, "latency_ms": latency_ms, "count": count
+                })
+                return count
+            error = f"状态码 {response.status_code}"
+            message = f"API[{source.name}]请求失败，状态码: {response.status_code}"
+        except requests.exceptions.RequestException as e:
+            error = str(e)
+            message = f"API[{source.name}]请求错误: {error}"
+        except json.JSONDecodeError:
+            error = "响应不是有效JSON"
+            message = f"API[{source.name}]返回的不是有效JSON数据"
+        if response is None:
+            # 连接失败等没有拿到响应的情况，耗时同样计入
+            self.metrics.observe("poll_latency_seconds", time.monotonic() - started, source=source.name)
+        self.metrics.inc("polls", source=source.name, result="error")
+        log(message, extra={
+            "event": "poll_error", "source": source.name, "error": error,
+            "latency_ms": round((time.monotonic() - started) * 1000)
+        })
+        return None
+
+    @staticmethod
+    def next_cursor(data, previous):
+        """优先使用响应中的 next_cursor/cursor 字段，否则取本次通知中最新的时间戳"""
+        cursor = data.get("next_cursor") or data.get("cursor")
+        if cursor:
+            return str(cursor)
+        timestamps = [n.get("timestamp") for n in data.get("notifications", []) if n.get("timestamp")]
+        if timestamps:
+            return max([previous] + timestamps if previous else timestamps)
+        return previous
+
+    def shutdown(self):
+        self.scheduler.stop()
+        self.stop_streams()
+        if self.session:
+            self.session.close()
+
+    def process_api_response(self, data, source):
+        notifications = data.get("notifications", [])
+        if not notifications:
+            logging.debug(f"API[{source.name}]返回无新通知")
+            return 0
+
+        received_at = time.monotonic()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.metrics.inc("received", len(notifications), transport=source.mode)
+        valid = []
+        for notification in notifications:
+            try:
+                if not isinstance(notification, dict):
+                    raise ValueError("通知必须是JSON对象")
+                valid.append({
+                    "title": _scalar_field(notification, "title", "API通知"),
+                    "message": _scalar_field(notification, "message", "收到新通知"),
+                    "timestamp": _scalar_field(notification, "timestamp", now),
+                    "source": source.name,
+                    "id": _scalar_field(notification, "id", None),
+                    "received_at": received_at
+                })
+            except ValueError as e:
+                logging.warning(f"API[{source.name}]返回的通知无效，已跳过: {str(e)}")
+        notifications = valid
+        if not notifications:
+            return 0
+        if self.deduper:
+            flags = self.deduper.filter(notifications)
+            fresh = [n for n, is_fresh in zip(notifications, flags) if is_fresh]
+            self.metrics.inc("dedup_dropped", len(notifications) - len(fresh), transport=source.mode)
+            notifications = fresh
+            if not notifications:
+                logging.info(f"API[{source.name}]返回的通知均已收到过", extra={
+                    "event": "dedup_dropped", "source": source.name
+                })
+                return 0
+
+        logging.info(f"从API[{source.name}]获取到 {len(notifications)} 条新通知", extra={
+            "event": "notifications_fetched", "source": source.name, "count": len(notifications)
+        })
+        self.on_notifications(notifications)
+        return len(notifications)
+
+class JsonSettings:
+    """守护进程的设置，从JSON文件读取，value 的用法与 QSettings.value 相同
+
+    键名与托盘应用的设置一致，api_sources 可以直接写成数组。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning(f"读取设置文件失败，将使用默认设置: {str(e)}")
+
+    def value(self, key, default=None, type=None):
+        value = self.data.get(key, default)
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, ensure_ascii=False)
+        if value is None or type is None:
+            return value
+        if type is bool and isinstance(value, str):
+            return value.lower() in ("true", "1", "yes")
+        return type(value)
+
+def encode_event(event):
+    return (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+
+class FrontendServer:
+    """守护进程的本地套接字服务，托盘前端通过它接收通知事件
+
+    协议为NDJSON：连接建立后先收到一条 snapshot 事件，之后是增量的 notifications、read、
+    read_all 和 status 事件；前端可以发送 mark_read 和 mark_all_read 命令。
+    每个前端有独立的有界发送队列，处理不过来的前端会被断开，不影响其他前端。
+    """
+    QUEUE_SIZE = 1000
+
+    def __init__(self, path, daemon):
+        self.path = path
+        self.daemon = daemon
+        self.clients = set()
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def start(self):
+        remove_stale_socket(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        bind_private_socket(sock, self.path)
+        sock.listen(16)
+        self._sock = sock
+        threading.Thread(target=self._accept_loop, name="FrontendServer", daemon=True).start()
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break
+            client = _FrontendClient(conn, self)
+            # 快照和注册在同一把锁内完成，前端不会漏掉或重复收到事件
+            with self.daemon.lock:
+                client.send(encode_event(self.daemon.snapshot()))
+                with self._lock:
+                    self.clients.add(client)
+            client.start()
+            logging.info(f"托盘前端已连接，当前 {len(self.clients)} 个", extra={"event": "frontend_connected"})
+
+    def broadcast(self, event):
+        """调用方需持有 daemon.lock"""
+        data = encode_event(event)
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.send(data)
+
+    def discard(self, client):
+        with self._lock:
+            if client not in self.clients:
+                return
+            self.clients.discard(client)
+            count = len(self.clients)
+        logging.info(f"托盘前端已断开，当前 {count} 个", extra={"event": "frontend_disconnected"})
+
+    def close(self):
+        if self._sock:
+            self._sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        with self._lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+
+class _FrontendClient:
+    """一个前端连接：写线程发送事件队列，读线程接收命令"""
+
+    def __init__(self, conn, server):
+        self.conn = conn
+        self.server = server
+        self.queue = queue.Queue(maxsize=server.QUEUE_SIZE)
+        self.closed = False
+
+    def start(self):
+        threading.Thread(target=self._write_loop, name="FrontendWriter", daemon=True).start()
+        threading.Thread(target=self._read_loop, name="FrontendReader", daemon=True).start()
+
+    def send(self, data):
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            logging.warning("托盘前端处理过慢，已断开连接")
+            self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.server.discard(self)
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass  # 写线程发送失败后会自行退出
+
+    def _write_loop(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                break
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                break
+        self.close()
+        self.conn.close()
+
+    def _read_loop(self):
+        try:
+            with self.conn.makefile("rb") as reader:
+                for line in reader:
+                    if not line.strip():
+                        continue
+                    try:
+                        command = json.loads(line)
+                    except ValueError:
+                        logging.warning("收到无效的前端命令，已忽略")
+                        continue
+                    if isinstance(command, dict):
+                        self.server.daemon.handle_command(command)
+        except OSError:
+            pass
+        self.close()
+
+class NotificationDaemon:
+    """通知核心：接收服务、远端轮询、去重、接收日志和通知历史
+
+    既可以作为守护进程单独运行（run），也可以由托盘应用在进程内运行，此时托盘应用只负责展示。
+    submit_notifications 和 handle_command 可在任意线程调用；写入历史和发布事件都在 lock 内完成，
+    所有前端看到的事件顺序与历史中的顺序一致。进程内的前端把回调加入 listeners 接收事件，
+    其他进程的前端通过 FrontendServer 的本地套接字接收。
+    """
+    SNAPSHOT_LIMIT = 50
+    SAVE_INTERVAL = 30  # 秒，去重记录的保存和接收日志的清理间隔
+
+    def __init__(self, settings, log):
+        self.settings = settings
+        self.log = log
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.status = ""
+        self.listeners = []
+        self.server = None
+        self.server_thread = None
+        self.ingest_server = None
+        os.makedirs(APP_DIR, exist_ok=True)
+
+        self.metrics = Metrics()
+        self.metrics.collectors.append(self.collect_metrics)
+        self.history_store = HistoryStore(os.path.join(APP_DIR, "history.db"))
+        # 接收日志：确认给客户端的通知先落盘，补写上次退出前还没写入历史的通知
+        self.journal = IngestJournal(os.path.join(APP_DIR, "journal.ndjson"), self.history_store.journal_seq)
+        self.journal.replay_into(self.history_store)
+        self.deduper = NotificationDeduper(os.path.join(APP_DIR, "dedup.json"))
+        self.limiter = IngestLimiter(settings.value("rate_limit", 50, type=int))
+        self.ingest_queue = IngestQueue(
+            settings.value("ingest_queue_size", 1000, type=int), self.process_ingest_queue
+        )
+        self.max_body_size = settings.value("max_body_size", MAX_BODY_SIZE, type=int)
+        self.frontends = FrontendServer(os.path.join(APP_DIR, "daemon.sock"), self)
+        self.poller = RemotePoller(self.handle_notifications, self.set_status, self.deduper, self.metrics)
+
+    def maintain(self):
+        """定期调用：保存去重记录，清理接收日志中已写入历史的部分"""
+        self.deduper.save()
+        with self.lock:
+            checkpoint = self.history_store.checkpoint()
+        self.journal.compact(checkpoint)
+
+    def collect_metrics(self, metrics):
+        metrics.set("queue_depth", self.log.queue_handler.queue.qsize(), queue="log")
+        metrics.set("queue_depth", len(self.ingest_queue), queue="ingest")
+        metrics.set("queue_depth", self.history_store.pending_count(), queue="history_writes")
+        metrics.set("log_dropped", self.log.queue_handler.dropped)
+        metrics.set("frontends", len(self.frontends.clients))
+        metrics.set("unread", self.history_store.unread_count)
+        metrics.set("history_total", self.history_store.total_count)
+
+    def submit_notifications(self, notifications, transport="http", client=None):
+        """线程安全地提交一批通知，返回与输入一一对应的布尔列表（True 表示已提交）
+
+        重复的通知在这里就被丢弃；客户端超过限速或接收队列已满时抛出 IngestRejected，整批都不会提交。
+        提交的是带 received_at 的副本，前端用它统计从收到到展示的延迟。新通知落盘到接收日志后
+        由 process_ingest_queue 在调用线程中直接写入历史，不等待其他线程处理。
+        """
+        self.limiter.admit(client, len(notifications))
+        received_at = time.monotonic()
+        flags = self.ingest_queue.put(
+            [dict(n, received_at=received_at) for n in notifications], self.deduper, self.journal
+        )
+        self.metrics.inc("received", len(notifications), transport=transport)
+        self.metrics.inc("dedup_dropped", flags.count(False), transport=transport)
+        return flags
+
+    def process_ingest_queue(self):
+        # 在 lock 内取出并写入历史，多个线程同时处理时历史中的顺序仍与接收日志一致
+        with self.lock:
+            notifications = self.ingest_queue.drain()
+            if notifications:
+                self.handle_notifications(notifications)
+
+    def handle_notifications(self, notifications):
+        records = make_history_records(notifications)
+        with self.lock:
+            self.history_store.add(records)
+            for record in records:
+                del record["journal_seq"]  # 接收日志序号只在写入历史时使用
+            event = {
+                "type": "notifications",
+                "items": records,
+                "unread": self.history_store.unread_count,
+                "total": self.history_store.total_count
+            }
+            for listener in self.listeners:
+                listener(event)
+            # 跨进程的单调时钟没有意义，套接字前端收到的通知不带 received_at
+            self.frontends.broadcast(dict(event, items=[
+                {k: v for k, v in record.items() if k != "received_at"} for record in records
+            ]))
+        logging.info(f"收到 {len(records)} 条通知", extra={
+            "event": "notification_received", "count": len(records),
+            "source": ",".join(sorted({record["source"] for record in records}))
+        })
+
+    def publish(self, event):
+        """把事件发给所有前端，调用方需持有 lock"""
+        for listener in self.listeners:
+            listener(event)
+        self.frontends.broadcast(event)
+
+    def handle_command(self, command):
+        """处理前端发来的命令，在前端连接的读线程（进程内的前端为GUI线程）中调用"""
+        kind = command.get("type")
+        with self.lock:
+            if kind == "mark_read":
+                try:
+                    requested = sorted({int(i) for i in command.get("ids", [])})
+                except (TypeError, ValueError):
+                    logging.warning("mark_read 命令的 ids 无效，已忽略")
+                    return
+                notification_ids = self.history_store.filter_unread(requested)
+                if not notification_ids:
+                    return
+                self.history_store.mark_read(notification_ids)
+                self.publish({
+                    "type": "read", "ids": notification_ids, "unread": self.history_store.unread_count
+                })
+            elif kind == "mark_all_read":
+                self.history_store.mark_all_read()
+                self.publish({"type": "read_all", "unread": 0})
+            else:
+                logging.warning(f"未知的前端命令: {kind}")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "type": "snapshot",
+                "notifications": self.history_store.recent(self.SNAPSHOT_LIMIT),
+                "unread": self.history_store.unread_count,
+                "total": self.history_store.total_count,
+                "status": self.status
+            }
+
+    def set_status(self, text):
+        with self.lock:
+            if text == self.status:
+                return
+            self.status = text
+            self.publish({"type": "status", "text": text})
+
+    def start_services(self, frontends=True):
+        """启动前端套接字、HTTP接收服务和本地套接字接收服务，端口或套接字不可用时抛出 OSError"""
+        if frontends:
+            self.frontends.start()
+        self.start_server()
+        self.start_ingest_server()
+
+    def start_polling(self):
+        self.poller.setup_polling(self.settings, initial_delay=5)
+
+    def start_server(self):
+        engine = self.settings.value("receiver_engine", "threading")
+        server_address = ('', self.settings.value("server_port", 8000, type=int))
+        if engine == "asyncio":
+            max_connections = self.settings.value("max_connections", 100, type=int)
+            self.server = AsyncNotificationServer(self, server_address, max_connections, self.max_body_size)
+        else:
+            self.server = NotificationHTTPServer(server_address, self, self.max_body_size)
+        self.server_thread = threading.Thread(target=self._serve, name="NotificationServer", daemon=True)
+        self.server_thread.start()
+        logging.info(f"服务器({engine})运行在端口 {server_address[1]}", extra={"event": "server_started"})
+
+    def start_ingest_server(self):
+        self.ingest_server = UnixIngestServer(os.path.join(APP_DIR, "ingest.sock"), self, self.max_body_size)
+        threading.Thread(target=self.ingest_server.serve_forever, name="IngestServer", daemon=True).start()
+        logging.info(f"本地套接字接收服务: {self.ingest_server.server_address}", extra={"event": "server_started"})
+
+    def _serve(self):
+        try:
+            self.server.serve_forever()
+        except OSError as e:
+            logging.error(f"服务器启动失败: {str(e)}")
+            self.stopped.set()
+
+    def run(self):
+        """作为守护进程运行直到收到 SIGTERM/SIGINT，返回进程退出码"""
+        try:
+            self.start_services()
+        except OSError as e:
+            logging.error(f"守护进程启动失败: {str(e)}")
+            self.shutdown()
+            return 1
+
+        signal.signal(signal.SIGINT, self.signal_handler)
+        signal.signal(signal.SIGTERM, self.signal_handler)
+        self.start_polling()
+        logging.info(f"守护进程已启动，前端套接字: {self.frontends.path}", extra={"event": "daemon_started"})
+
+        while not self.stopped.wait(self.SAVE_INTERVAL):
+            self.maintain()
+        self.shutdown()
+        logging.info("守护进程已关闭", extra={"event": "app_stopped"})
+        return 0
+
+    def signal_handler(self, signum, frame):
+        logging.info("收到终止信号，正在关闭...")
+        self.stopped.set()
+
+    def shutdown(self):
+        self.poller.shutdown()
+        if self.server:
+            self.server.shutdown()
+            if isinstance(self.server, NotificationHTTPServer):
+                self.server.server_close()
+        if self.server_thread:
+            self.server_thread.join(1)
+        if self.ingest_server:
+            self.ingest_server.shutdown()
+            self.ingest_server.server_close()
+        self.frontends.close()
+        self.history_store.close()
+        self.journal.close()
+        self.deduper.save()
+
+def main():
+    parser = argparse.ArgumentParser(description="NotifyPI 守护进程：无界面运行通知接收、远端轮询和通知历史")
+    parser.add_argument(
+        "--config", default=os.path.join(APP_DIR, "daemon.json"),
+        help="JSON格式的设置文件，键名与托盘应用的设置相同"
+    )
+    args = parser.parse_args()
+    settings = JsonSettings(args.config)
+    log = QueuedLogging(settings, "daemon.log")
+    code = NotificationDaemon(settings, log).run()
+    log.stop()
+    sys.exit(code)
+
+if __name__ == "__main__":
+    main()